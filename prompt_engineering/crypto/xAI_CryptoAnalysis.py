@@ -1,24 +1,26 @@
 # xAI.py - main file for xAI project
 
+import asyncio
 import os
-from openai import OpenAI
+import sys
 from dotenv import load_dotenv
 
-# Load .env file
+# Load .env file before llm_client reads the API keys from the environment
 load_dotenv()
 
-# Get API keys from .env file
-XAI_API_KEY = os.getenv("XAI_API_KEY")
+# Shared pooled client with retries, from the workflow package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "workflow"))
+from llm_client import get_client
 
-# Initialize OpenAI client
-client = OpenAI(
-    api_key=XAI_API_KEY,
-    base_url="https://api.x.ai/v1",
-)
+async def analyze(messages):
+    client = get_client()
+    try:
+        return await client.chat(model="grok-beta", messages=messages)
+    finally:
+        await client.aclose()
 
 # Generate analysis
-completion = client.chat.completions.create(
-    model="grok-beta",
+completion = asyncio.run(analyze(
     messages=[
         {"role": "system", "content": 
          
@@ -63,8 +65,7 @@ completion = client.chat.completions.create(
          },
 
         {"role": "user", "content": "$dogecoin"},
-    ],
-)
+    ]))
 
 # Print the analysis
 print(completion.choices[0].message.content)
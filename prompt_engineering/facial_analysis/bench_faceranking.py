@@ -0,0 +1,86 @@
+# Check FacePlusPlusClient.rank_faces against a local stub Face++ server
+# The stub enforces a concurrency limit the way Face++ does (403 CONCURRENCY_LIMIT_EXCEEDED),
+# returns several faces per image and is slow enough for concurrency to matter
+
+import asyncio
+import hashlib
+import time
+
+from aiohttp import web
+
+from faceranking import FacePlusPlusClient
+
+STUB_CONCURRENCY = 3
+STUB_LATENCY = 0.05
+
+def stub_faces(image: bytes):
+    """Deterministic 1-3 faces per image, derived from its bytes"""
+    digest = hashlib.blake2b(image, digest_size=16).digest()
+    return [
+        {
+            "face_token": f"{digest.hex()}-{i}",
+            "face_rectangle": {"top": 10 * i, "left": 10 * i, "width": 50, "height": 50},
+            "attributes": {
+                "beauty": {"male_score": digest[i] / 2.55, "female_score": digest[i + 3] / 2.55},
+                "age": {"value": 18 + digest[i + 6] % 40}
+            }
+        }
+        for i in range(1 + digest[0] % 3)
+    ]
+
+def make_app() -> web.Application:
+    in_flight = 0
+    stats = {"requests": 0, "rejected": 0}
+
+    async def detect(request: web.Request) -> web.Response:
+        nonlocal in_flight
+        stats["requests"] += 1
+        form = await request.post()
+        if form.get("return_attributes") != "beauty,age":
+            return web.json_response({"error_message": "BAD_ARGUMENTS"}, status=400)
+        if in_flight >= STUB_CONCURRENCY:
+            stats["rejected"] += 1
+            return web.json_response({"error_message": "CONCURRENCY_LIMIT_EXCEEDED"}, status=403)
+        in_flight += 1
+        try:
+            await asyncio.sleep(STUB_LATENCY)
+            image = form["image_file"].file.read()
+            return web.json_response({"faces": stub_faces(image)})
+        finally:
+            in_flight -= 1
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_post("/facepp/v3/detect", detect)
+    return app
+
+async def main():
+    app = make_app()
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 8766).start()
+    url = "http://127.0.0.1:8766/facepp/v3/detect"
+    images = [f"image-{i}".encode() * 100 for i in range(60)]
+
+    try:
+        for concurrency in (1, STUB_CONCURRENCY, STUB_CONCURRENCY * 2):
+            async with FacePlusPlusClient(api_key="stub", api_secret="stub", url=url,
+                                          max_concurrency=concurrency, base_delay=0.05) as client:
+                start = time.perf_counter()
+                ranked = await client.rank_faces(images)
+                elapsed = time.perf_counter() - start
+
+            # Every image scored, every face returned, ranks follow the best face's score
+            assert all("faces" in r for r in ranked), [r for r in ranked if "faces" not in r][:1]
+            assert all(r["face_count"] == len(stub_faces(images[r["index"]])) for r in ranked)
+            by_rank = sorted(ranked, key=lambda r: r["rank"])
+            best = [r["faces"][0]["beauty_score"] for r in by_rank]
+            assert best == sorted(best, reverse=True)
+            print(f"max_concurrency={concurrency}: {len(images)} images in {elapsed:.2f}s, "
+                  f"{sum(r['face_count'] for r in ranked)} faces, {client.retries} retries")
+        print(f"stub server: {app['stats']}")
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
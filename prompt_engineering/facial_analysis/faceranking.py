@@ -1,35 +1,72 @@
 # faceranking - Rating faces based on beauty and age using Face++ API
 
-import requests
+import asyncio
 import os
+import random
+from typing import Any, Dict, List, Optional, Union
+
+import aiohttp
+import requests
+
+FACEPLUS_URL = 'https://api-us.faceplusplus.com/facepp/v3/detect'
+# call_faceplusplus_api caches the first face only, detect() caches every face - separate
+# scopes so neither returns the other's result shape
+FACEPLUS_CACHE_FIRST = 'faceplusplus-detect:first'
+FACEPLUS_CACHE_ALL = 'faceplusplus-detect:all'
+FACEPLUS_ATTRIBUTES = 'beauty,age'
+
+# Face++ rejects requests over the account's QPS with 403 CONCURRENCY_LIMIT_EXCEEDED
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RETRYABLE_MESSAGES = {'CONCURRENCY_LIMIT_EXCEEDED'}
+
+# Reused by call_faceplusplus_api so repeated calls keep the connection alive
+_session = requests.Session()
+
+def _parse_face(face: Dict) -> Dict:
+    attributes = face['attributes']
+    return {
+        'beauty_score': (attributes['beauty']['male_score'] + attributes['beauty']['female_score']) / 2,
+        'age': attributes['age']['value'],
+        'face_rectangle': face.get('face_rectangle'),
+        'face_token': face.get('face_token')
+    }
+
+def call_faceplusplus_api(image_stream, cache=None, timeout: float = 30):
+    """Call Face++ API and return beauty score and age
+
+    With an ImageResultCache, results for the same (or a near-duplicate) image are
+    returned from disk; errors are never cached. Only the first face is scored - use
+    FacePlusPlusClient.rank_faces for every face and for many images at once.
+    """
+    if cache is not None:
+        image_bytes = image_stream.read()
+        return cache.get_or_call(
+            image_bytes, FACEPLUS_CACHE_FIRST, FACEPLUS_ATTRIBUTES,
+            lambda: call_faceplusplus_api(image_bytes, timeout=timeout),
+            should_cache=lambda result: 'error' not in result
+        )
 
-def call_faceplusplus_api(image_stream):
-    """Call Face++ API and return beauty score and age"""
-    url = 'https://api-us.faceplusplus.com/facepp/v3/detect'
-    
     files = {'image_file': image_stream}
     data = {
         'api_key': os.getenv('FACEPLUS_API_KEY'),
         'api_secret': os.getenv('FACEPLUS_API_SECRET'),
-        'return_attributes': 'beauty,age'  # Added age attribute
+        'return_attributes': FACEPLUS_ATTRIBUTES  # Added age attribute
     }
-    
+
     try:
-        response = requests.post(url, files=files, data=data)
+        response = _session.post(FACEPLUS_URL, files=files, data=data, timeout=timeout)
         response.raise_for_status()
         result = response.json()
-        
+
         if 'faces' not in result or not result['faces']:
             return {'error': 'No face detected in the image'}
-            
-        face = result['faces'][0]
-        attributes = face['attributes']
-        
+
+        face = _parse_face(result['faces'][0])
         return {
-            'beauty_score': (attributes['beauty']['male_score'] + attributes['beauty']['female_score']) / 2,
-            'age': attributes['age']['value']
+            'beauty_score': face['beauty_score'],
+            'age': face['age']
         }
-        
+
     except requests.exceptions.RequestException as e:
         return {'error': f'API request failed: {str(e)}'}
     except KeyError as e:
@@ -37,4 +74,179 @@ def call_faceplusplus_api(image_stream):
     except Exception as e:
         return {'error': f'An error occurred: {str(e)}'}
 
+class FacePlusPlusError(Exception):
+    """Face++ request that failed after all retries"""
+
+class FacePlusPlusClient:
+    """Async Face++ client with a pooled session, timeouts and rate-limit-aware retries
+
+    Concurrency adapts to the account's limit: every CONCURRENCY_LIMIT_EXCEEDED halves the
+    number of requests allowed in flight, and each run of successes raises it by one again,
+    up to max_concurrency.
+
+    Use as an async context manager so the session is closed:
+
+        async with FacePlusPlusClient() as client:
+            ranked = await client.rank_faces(["a.jpg", "b.jpg"])
+    """
+
+    def __init__(self, api_key: str = None, api_secret: str = None, url: str = FACEPLUS_URL,
+                 max_concurrency: int = 3, timeout: float = 30, max_retries: int = 5,
+                 base_delay: float = 0.5, max_delay: float = 8.0, cache=None):
+        self.api_key = api_key or os.getenv('FACEPLUS_API_KEY')
+        self.api_secret = api_secret or os.getenv('FACEPLUS_API_SECRET')
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Optional ImageResultCache - successful results are stored per image
+        self.cache = cache
+        self.retries = 0
+        self._limit = max_concurrency
+        self._in_flight = 0
+        self._successes = 0
+        self._slots = asyncio.Condition()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self):
+        self._get_session()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=30),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter so concurrent requests don't retry in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def _acquire(self):
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._in_flight < self._limit)
+            self._in_flight += 1
+
+    async def _release(self, rate_limited: bool):
+        async with self._slots:
+            self._in_flight -= 1
+            if rate_limited:
+                self._limit = max(1, self._limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self._limit and self._limit < self.max_concurrency:
+                    self._limit += 1
+                    self._successes = 0
+            self._slots.notify_all()
+
+    @staticmethod
+    def _read_image(image: Union[str, bytes, Any]) -> bytes:
+        if isinstance(image, bytes):
+            return image
+        if isinstance(image, (str, os.PathLike)):
+            with open(image, 'rb') as f:
+                return f.read()
+        return image.read()
+
+    async def _post_once(self, image_bytes: bytes):
+        """One POST holding an adaptive slot - returns (status, JSON body or None)"""
+        form = aiohttp.FormData()
+        form.add_field('api_key', self.api_key or '')
+        form.add_field('api_secret', self.api_secret or '')
+        form.add_field('return_attributes', FACEPLUS_ATTRIBUTES)
+        form.add_field('image_file', image_bytes, filename='image.jpg', content_type='application/octet-stream')
+        await self._acquire()
+        status, body = None, None
+        try:
+            async with self._get_session().post(self.url, data=form) as response:
+                status = response.status
+                try:
+                    body = await response.json(content_type=None)
+                except ValueError:
+                    # Gateways answer some errors with HTML or plain text
+                    body = None
+            return status, body
+        finally:
+            message = body.get('error_message') if isinstance(body, dict) else None
+            await self._release(status == 429 or message in RETRYABLE_MESSAGES)
+
+    async def _post(self, image_bytes: bytes) -> Dict:
+        """POST one image, retrying rate limits, server errors and timeouts"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                status, body = await self._post_once(image_bytes)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise FacePlusPlusError(f'API request failed: {e!r}') from e
+            else:
+                if status == 200 and isinstance(body, dict):
+                    return body
+                message = body.get('error_message', '') if isinstance(body, dict) else ''
+                if status not in RETRYABLE_STATUS and message not in RETRYABLE_MESSAGES:
+                    raise FacePlusPlusError(f'API request failed with {status}: {message}')
+                if attempt == self.max_retries:
+                    raise FacePlusPlusError(f'API request failed after {attempt + 1} attempts: {status} {message}')
+            self.retries += 1
+            # Sleep after releasing the slot so waiting retries don't hold one
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def detect(self, image: Union[str, bytes, Any]) -> Dict:
+        """Score every face in one image
+
+        Returns {'faces': [...], 'face_count': n} with faces sorted by beauty score, or
+        {'error': ...}. Accepts a path, raw bytes or a readable file object.
+        """
+        image_bytes = self._read_image(image)
+        if self.cache is not None:
+            # Hashing, SQLite and (with near-duplicates on) decoding block - keep them off the event loop
+            cached = await asyncio.to_thread(self.cache.get, image_bytes, FACEPLUS_CACHE_ALL, FACEPLUS_ATTRIBUTES)
+            if cached is not None:
+                return cached
+        try:
+            result = await self._post(image_bytes)
+            faces = sorted((_parse_face(face) for face in result.get('faces', [])),
+                           key=lambda face: face['beauty_score'], reverse=True)
+        except FacePlusPlusError as e:
+            return {'error': str(e)}
+        except KeyError as e:
+            return {'error': f'Unexpected API response format: {str(e)}'}
+        if not faces:
+            return {'error': 'No face detected in the image'}
+        detected = {'faces': faces, 'face_count': len(faces)}
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.set, image_bytes, FACEPLUS_CACHE_ALL, FACEPLUS_ATTRIBUTES, detected)
+        return detected
+
+    async def rank_faces(self, images: List[Union[str, bytes, Any]]) -> List[Dict]:
+        """Score many images concurrently and rank them by their best face
+
+        Results keep input order; each has 'index', the detect() fields and 'rank'
+        (1 = highest beauty score, None when the image failed).
+        """
+        results = await asyncio.gather(*(self.detect(image) for image in images))
+        ranked = [{'index': i, **result} for i, result in enumerate(results)]
+        scored = sorted((r for r in ranked if 'faces' in r),
+                        key=lambda r: r['faces'][0]['beauty_score'], reverse=True)
+        for rank, result in enumerate(scored, start=1):
+            result['rank'] = rank
+        for result in ranked:
+            result.setdefault('rank', None)
+        return ranked
 
+async def rank_faces(images: List[Union[str, bytes, Any]], **client_kwargs) -> List[Dict]:
+    """One-off batch ranking with a temporary client"""
+    async with FacePlusPlusClient(**client_kwargs) as client:
+        return await client.rank_faces(images)
@@ -1,32 +1,23 @@
-import PIL.Image
+import argparse
+import asyncio
+import json
 import os
+import sys
+import time
 from dotenv import load_dotenv
 import google.generativeai as genai
 import typing_extensions as typing
-from typing import Dict, List
-import json
-import base64
-
-image_path_1 = "./images/pancakes.jpg"  # Replace with the actual path to your first image
-image_path_2 = "./images/pancakes.jpg" # Replace with the actual path to your second image
-
-sample_file_1 = PIL.Image.open(image_path_1)
-sample_file_2 = PIL.Image.open(image_path_2)
-
-# Convert image to base64
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
-
-base64_image_1 = encode_image(image_path_1)
-base64_image_2 = encode_image(image_path_2)
-
+from typing import Dict, Iterator, List, Set, Tuple, get_type_hints
 
+# Load .env file before llm_client reads the API keys from the environment
 load_dotenv()
 
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-
-genai.configure(api_key=GEMINI_API_KEY)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "workflow"))
+from image_cache import ImageResultCache, prompt_version
+from image_preprocess import prepare_image
+from json_extract import ModelOutputError, SchemaValidationError, parse_json, validate
+from llm_client import LLMClient, get_client
 
 #Define the JSON schema
 class Output(typing.TypedDict):
@@ -42,12 +33,13 @@ class Output(typing.TypedDict):
     description: Dict[str, List[str]]
     image_quality: Dict[str, typing.Union[str, List[str]]]
 
-
+# Fields the prompt asks for as 0-100 integers
+SCORE_FIELDS = ("score", "potential_score", "confidence", "skin", "jawline", "hair", "smile")
 
 #model_name = "gemini-1.5-pro"
-model_name = "gemini-1.5-flash"
-#Choose a Gemini model.
-model = genai.GenerativeModel(model_name=model_name)
+MODEL_NAME = "gemini-1.5-flash"
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif"}
 
 prompt = """You are a professional image analysis model. Analyze the provided images and output a structured JSON response with the following specific scores and attributes:
 
@@ -65,25 +57,230 @@ Required fields:
 - image_quality: Object with quality assessment details
 
 Please ensure all numeric scores are provided as integers between 0 and 100."""
- 
-response = model.generate_content([prompt, base64_image_1, base64_image_2]
-                                  , generation_config=genai.GenerationConfig(temperature=0.1, response_mime_type="application/json" ))
 
-#print output
-#print(response.text)
+# Changes whenever the prompt or Output schema does, so stale cached results aren't reused
+PROMPT_VERSION = prompt_version(prompt, str(get_type_hints(Output)))
+
+generation_config = {"temperature": 0.1, "response_mime_type": "application/json"}
+
+def load_model(model_name: str = MODEL_NAME, client: LLMClient = None) -> genai.GenerativeModel:
+    return (client or get_client()).gemini_model(model_name, generation_config=generation_config)
+
+def _score_range_errors(value: Dict) -> List[str]:
+    return [f"$.{field}: {value[field]} is outside 0-100"
+            for field in SCORE_FIELDS if not 0 <= value[field] <= 100]
+
+def validate_output(value) -> List[str]:
+    """Problems with a parsed response, checked against Output - empty when it is valid"""
+    return validate(value, Output) or _score_range_errors(value)
+
+def parse_output(text: str) -> Output:
+    """Output from a response; raises ModelOutputError when it can't be used"""
+    value = parse_json(text, Output, label="image_scores")
+    errors = _score_range_errors(value)
+    if errors:
+        raise SchemaValidationError(errors, value)
+    return value
+
+async def analyze_image(model: genai.GenerativeModel, image_path: str, cache: ImageResultCache = None,
+                        client: LLMClient = None, max_attempts: int = 3, timeout: float = 60) -> Output:
+    """Score one image; raises ModelOutputError or the API error once retries run out
+
+    Rate limits and transient errors are retried by the shared client; invalid responses
+    are asked for again too - at temperature 0.1 a rerun usually fixes them. With a cache,
+    results for the same image (or a near-duplicate, if enabled) come from disk.
+    """
+    client = client or get_client()
+    # Decoding, resizing, hashing and the SQLite scan are all blocking - keep them off the event loop
+    image = await asyncio.to_thread(prepare_image, image_path)
+    if cache is not None:
+        cached = await asyncio.to_thread(cache.get, image, model.model_name, PROMPT_VERSION)
+        if cached is not None and not validate_output(cached):
+            return cached
+
+    for attempt in range(max_attempts):
+        response = await client.generate(model, [prompt, image.gemini_part()],
+                                         request_options={"timeout": timeout})
+        try:
+            result = parse_output(response.text)
+            break
+        except ModelOutputError:
+            if attempt == max_attempts - 1:
+                raise
+
+    if cache is not None:
+        await asyncio.to_thread(cache.set, image, model.model_name, PROMPT_VERSION, result)
+    return result
+
+def iter_images(directory: str) -> Iterator[str]:
+    """Image paths under directory, relative to it, in a stable order
+
+    Walks lazily so a job over tens of thousands of files starts immediately.
+    """
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                yield os.path.relpath(os.path.join(root, name), directory)
+
+def load_completed(output_path: str) -> Set[str]:
+    """Paths already scored in a previous run's JSONL - failed images are retried
+
+    A run killed mid-write can leave a partial last line; it is cut off so appended
+    records start on a fresh line.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        record = json.loads(line)
+        if "error" not in record:
+            completed.add(record["path"])
+    return completed
+
+async def analyze_directory(directory: str, output_path: str, concurrency: int = 8,
+                            model: genai.GenerativeModel = None, cache: ImageResultCache = None,
+                            client: LLMClient = None, progress_every: int = 100) -> Dict:
+    """Score every image under directory, appending one JSONL record per image
+
+    Records are {"path", **Output} or {"path", "error"}; each is flushed as soon as it
+    is written, so rerunning after a crash skips images that already succeeded. When an
+    image is retried, the later record for its path supersedes the earlier one.
+    """
+    client = client or get_client()
+    model = model or load_model(client=client)
+    completed = load_completed(output_path)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    counts = {"skipped": len(completed), "ok": 0, "failed": 0}
+    start = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        def write(record: Dict):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            done = counts["ok"] + counts["failed"]
+            if done % progress_every == 0:
+                rate = done / (time.perf_counter() - start)
+                print(f"{done} images ({counts['failed']} failed), {rate:.1f}/s")
+
+        async def worker():
+            while True:
+                path = await queue.get()
+                if path is None:
+                    return
+                try:
+                    result = await analyze_image(model, os.path.join(directory, path), cache, client)
+                except Exception as e:
+                    counts["failed"] += 1
+                    write({"path": path, "error": f"{type(e).__name__}: {e}"})
+                else:
+                    counts["ok"] += 1
+                    write({"path": path, **result})
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            # The bounded queue keeps the directory scan just ahead of the workers
+            for path in iter_images(directory):
+                if path not in completed:
+                    await queue.put(path)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+    counts["elapsed"] = time.perf_counter() - start
+    return counts
+
+def _read_latest(jsonl_path: str) -> Iterator[Dict]:
+    """Records from an output JSONL, keeping only the last one written for each path"""
+    latest: Dict[str, Tuple[int, int]] = {}
+    with open(jsonl_path, "rb") as f:
+        offset = 0
+        for line in f:
+            latest[json.loads(line)["path"]] = (offset, len(line))
+            offset += len(line)
+        for offset, length in sorted(latest.values()):
+            f.seek(offset)
+            yield json.loads(f.read(length))
+
+def write_parquet(jsonl_path: str, parquet_path: str, batch_size: int = 10000) -> int:
+    """Convert an output JSONL to Parquet (requires pyarrow), one row per image
+
+    The nested description and image_quality objects are stored as JSON strings so every
+    batch has the same schema.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet output requires pyarrow: pip install pyarrow") from e
+
+    hints = get_type_hints(Output)
+    fields = [pa.field("path", pa.string())]
+    for field, expected in hints.items():
+        fields.append(pa.field(field, pa.int64() if expected is int else pa.string()))
+    fields.append(pa.field("error", pa.string()))
+    schema = pa.schema(fields)
+
+    def to_row(record: Dict) -> Dict:
+        row = {}
+        for field in schema.names:
+            value = record.get(field)
+            row[field] = json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+        return row
 
-response_json = json.loads(response.text)
+    rows = 0
+    with pq.ParquetWriter(parquet_path, schema) as writer:
+        batch = []
+        for record in _read_latest(jsonl_path):
+            batch.append(to_row(record))
+            if len(batch) == batch_size:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                rows += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            rows += len(batch)
+    return rows
 
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Score every image in a directory with Gemini")
+    parser.add_argument("directory", help="Directory of images, scanned recursively")
+    parser.add_argument("output", help="JSONL results file; rerun with the same file to resume")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--parquet", help="Also write the results to this Parquet file when done")
+    parser.add_argument("--cache", default="image_results.db", help="Result cache database")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the model")
+    parser.add_argument("--near-duplicate-distance", type=int, default=0,
+                        help="Also reuse results for near-duplicate images within this many of 256 "
+                             "perceptual-hash bits (0, the default, matches exact content only)")
+    args = parser.parse_args(argv)
 
-print("score: ", response_json['score'])
-print("potential_score: ", response_json['potential_score'])
-print("confidence: ", response_json['confidence'])
-print("skin: ", response_json['skin'])
-print("jawline: ", response_json['jawline'])
-print("hair: ", response_json['hair'])
-print("smile: ", response_json['smile'])
-print("visual_age: ", response_json['visual_age'])
-print("age_percentage: ", response_json['age_percentage'])
-print("description: ", response_json['description'])
-print("image_quality: ", response_json['image_quality']['lighting'])
+    # Re-uploads of the same photos (and near-duplicates, when enabled) are answered from disk
+    cache = None if args.no_cache else ImageResultCache(args.cache, max_distance=args.near_duplicate_distance)
+    # Let the client's Gemini limit match the worker count instead of its default
+    client = LLMClient(concurrency={"gemini": args.concurrency})
+    try:
+        counts = asyncio.run(analyze_directory(args.directory, args.output, args.concurrency,
+                                               load_model(args.model, client), cache, client))
+    finally:
+        if cache is not None:
+            print(cache.stats())
+            cache.close()
+    print(f"{counts['ok']} scored, {counts['failed']} failed, {counts['skipped']} already done "
+          f"in {counts['elapsed']:.1f}s")
+    if args.parquet:
+        rows = write_parquet(args.output, args.parquet)
+        print(f"Wrote {rows} rows to {args.parquet}")
 
+if __name__ == "__main__":
+    # python gemini/structured_output.py ./images results.jsonl --concurrency 16
+    main()
@@ -1,22 +1,29 @@
-import PIL.Image
+import asyncio
 import os
+import sys
 from dotenv import load_dotenv
-import google.generativeai as genai
 
-image_path_1 = "./images/amade.png"  # Replace with the actual path to your first image
-image_path_2 = "./images/webcam_photo.jpg" # Replace with the actual path to your second image
-
-sample_file_1 = PIL.Image.open(image_path_1)
-sample_file_2 = PIL.Image.open(image_path_2)
+# Load .env file before llm_client reads the API keys from the environment
+load_dotenv()
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "workflow"))
+from image_preprocess import prepare_image
+from llm_client import get_client
 
-load_dotenv()
+image_path_1 = "./images/amade.png"  # Replace with the actual path to your first image
+image_path_2 = "./images/webcam_photo.jpg" # Replace with the actual path to your second image
 
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+# Downscaled, EXIF-free JPEGs sent as inline blobs, so the SDK doesn't re-encode full-size images
+sample_file_1 = prepare_image(image_path_1)
+sample_file_2 = prepare_image(image_path_2)
+print(sample_file_1.report())
+print(sample_file_2.report())
 
-genai.configure(api_key=GEMINI_API_KEY)
+# Shared client: configures genai once and retries rate limits with backoff
+client = get_client()
 #Choose a Gemini model.
-model = genai.GenerativeModel(model_name="gemini-1.5-pro")
+model = client.gemini_model("gemini-1.5-pro")
 
 prompt = """Give this person a score out of (0-100), as well as a potential score(0-100)
     Use this JSON schema: 
@@ -59,7 +66,7 @@ prompt = """Give this person a score out of (0-100), as well as a potential scor
 
 """
 
-response = model.generate_content([prompt, sample_file_1, sample_file_2])
+response = asyncio.run(client.generate(model, [prompt, sample_file_1.gemini_part(), sample_file_2.gemini_part()]))
 
 #print(response.text)
 
@@ -0,0 +1,223 @@
+# Disk cache for image analysis results
+# Keyed by the image content plus model name and a prompt version derived from the prompt
+# text; near-duplicate uploads (re-saved, re-compressed or slightly resized copies) can
+# optionally be matched by perceptual hash
+
+import hashlib
+import io
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from PIL import Image
+
+from image_preprocess import PreparedImage
+
+ImageInput = Union[PreparedImage, bytes, List[Union[PreparedImage, bytes]]]
+
+# Bumped when the stored layout changes - older cache files are cleared on open
+SCHEMA_VERSION = 2
+
+# Near-duplicates must also agree on colour (max per-channel difference over a 4x4
+# thumbnail) and aspect ratio - grayscale gradients alone can't tell two flat images apart
+COLOR_TOLERANCE = 6
+ASPECT_TOLERANCE = 0.02
+
+def _image_bytes(image: Union[PreparedImage, bytes]) -> bytes:
+    return image.data if isinstance(image, PreparedImage) else image
+
+def prompt_version(*texts: str) -> str:
+    """Short hash identifying an analysis by its prompt (and any schema text)
+
+    Use it as the prompt_version so two analyses of the same photo never share an entry,
+    and editing a prompt invalidates its old results without a hand-bumped number.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def _dhash_bits(img: Image.Image, size: int) -> int:
+    pixels = list(img.convert("L").resize((size + 1, size), Image.LANCZOS).getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+def dhash(data: bytes, size: int = 16) -> int:
+    """size*size-bit difference hash - similar images differ in only a few bits"""
+    with Image.open(io.BytesIO(data)) as img:
+        return _dhash_bits(img, size)
+
+def perceptual_signature(data: bytes) -> str:
+    """256-bit dHash, 4x4 RGB thumbnail and aspect ratio of an image, as one string"""
+    with Image.open(io.BytesIO(data)) as img:
+        bits = _dhash_bits(img, 16)
+        thumbnail = img.convert("RGB").resize((4, 4), Image.BOX).tobytes()
+        aspect = img.size[0] / img.size[1]
+    return f"{bits:064x}:{thumbnail.hex()}:{aspect:.4f}"
+
+def _hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def _distance(a: str, b: str) -> Optional[int]:
+    """dHash bit distance between two signatures, or None when colour or shape differ"""
+    hash_a, thumb_a, aspect_a = a.split(":")
+    hash_b, thumb_b, aspect_b = b.split(":")
+    if abs(float(aspect_a) - float(aspect_b)) > ASPECT_TOLERANCE * float(aspect_a):
+        return None
+    if max(abs(x - y) for x, y in zip(bytes.fromhex(thumb_a), bytes.fromhex(thumb_b))) > COLOR_TOLERANCE:
+        return None
+    return _hamming(int(hash_a, 16), int(hash_b, 16))
+
+class ImageResultCache:
+    """SQLite-backed cache of JSON results for one or more images per request
+
+    Lookups match the exact image content for the same model and prompt version. With
+    `max_distance` > 0 (opt-in; around 10 of 256 bits is a reasonable start), a miss falls
+    back to the closest stored entry whose images all agree in colour and aspect ratio and
+    whose perceptual hashes are within `max_distance` bits. Entries expire after `ttl`
+    seconds and the least recently used are evicted past `max_entries`.
+
+    Safe to call from worker threads (e.g. asyncio.to_thread): hashing runs in the caller's
+    thread, database access is serialized.
+    """
+
+    def __init__(self, path: str = "image_cache.db", max_entries: int = 5000,
+                 ttl: float = 30 * 24 * 3600, max_distance: int = 0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.hits = {"exact": 0, "near_duplicate": 0}
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            # It's a cache - entries in an older layout are dropped rather than migrated
+            self._conn.execute("DROP TABLE IF EXISTS image_results")
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS image_results (
+                key TEXT PRIMARY KEY,
+                scope TEXT NOT NULL,
+                signatures TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS image_results_scope ON image_results (scope)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS image_results_accessed ON image_results (accessed_at)")
+        self._conn.commit()
+
+    def _fingerprint(self, images: ImageInput, model: str, prompt_version: Any):
+        """(key, scope, perceptual signatures) for a request
+
+        Signatures are only computed when near-duplicate matching is on; entries stored
+        without them are matched by exact content only.
+        """
+        datas = [_image_bytes(i) for i in (images if isinstance(images, list) else [images])]
+        scope = f"{model}:{prompt_version}"
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(scope.encode("utf-8"))
+        for data in datas:
+            digest.update(hashlib.blake2b(data, digest_size=16).digest())
+        signatures = [perceptual_signature(data) for data in datas] if self.max_distance > 0 else []
+        return digest.hexdigest(), scope, signatures
+
+    def _lookup(self, key: str, scope: str, signatures: List[str]) -> Optional[str]:
+        with self._lock:
+            return self._lookup_locked(key, scope, signatures)
+
+    def _lookup_locked(self, key: str, scope: str, signatures: List[str]) -> Optional[str]:
+        now = time.time()
+        row = self._conn.execute(
+            "SELECT key, value FROM image_results WHERE key = ? AND created_at > ?", (key, now - self.ttl)
+        ).fetchone()
+        if row is not None:
+            self.hits["exact"] += 1
+        elif signatures:
+            best = None
+            for candidate_key, stored, value in self._conn.execute(
+                "SELECT key, signatures, value FROM image_results "
+                "WHERE scope = ? AND signatures != '' AND created_at > ?",
+                (scope, now - self.ttl)
+            ):
+                stored_signatures = stored.split(",")
+                if len(stored_signatures) != len(signatures):
+                    continue
+                distances = [_distance(a, b) for a, b in zip(signatures, stored_signatures)]
+                if None in distances:
+                    continue
+                distance = max(distances)
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, candidate_key, value)
+            if best is not None:
+                row = best[1:]
+                self.hits["near_duplicate"] += 1
+        if row is None:
+            self.misses += 1
+            return None
+        self._conn.execute("UPDATE image_results SET accessed_at = ? WHERE key = ?", (now, row[0]))
+        self._conn.commit()
+        return row[1]
+
+    def get(self, images: ImageInput, model: str, prompt_version: Any) -> Optional[Any]:
+        """Stored result for these images, model and prompt version, or None"""
+        value = self._lookup(*self._fingerprint(images, model, prompt_version))
+        return None if value is None else json.loads(value)
+
+    def _store(self, key: str, scope: str, signatures: List[str], value: Any):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO image_results (key, scope, signatures, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, scope, ",".join(signatures), json.dumps(value), now, now)
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM image_results").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM image_results WHERE key IN "
+                    "(SELECT key FROM image_results ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def set(self, images: ImageInput, model: str, prompt_version: Any, value: Any):
+        """Store a JSON-serializable result"""
+        self._store(*self._fingerprint(images, model, prompt_version), value)
+
+    def get_or_call(self, images: ImageInput, model: str, prompt_version: Any,
+                    call: Callable[[], Any], should_cache: Callable[[Any], bool] = None) -> Any:
+        """Stored result, or call() and store what it returns (unless should_cache rejects it)"""
+        key, scope, signatures = self._fingerprint(images, model, prompt_version)
+        value = self._lookup(key, scope, signatures)
+        if value is not None:
+            return json.loads(value)
+        result = call()
+        if should_cache is None or should_cache(result):
+            self._store(key, scope, signatures, result)
+        return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = sum(self.hits.values())
+            lookups = hits + self.misses
+            return {
+                **self.hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": self._conn.execute("SELECT COUNT(*) FROM image_results").fetchone()[0]
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,116 @@
+# Image preprocessing for vision requests
+# Downscales, strips EXIF and re-encodes images once, so uploads are small and repeated
+# calls with the same file reuse the encoded bytes
+
+import base64
+import io
+import os
+from functools import lru_cache
+from typing import Dict
+
+from PIL import Image, ImageOps
+
+DEFAULT_MAX_SIDE = 1024
+DEFAULT_QUALITY = 85
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+# Totals across every image prepared in this process
+_totals = {"images": 0, "original_bytes": 0, "encoded_bytes": 0}
+
+class PreparedImage:
+    """Encoded image bytes plus the forms the Gemini and xAI clients expect"""
+
+    def __init__(self, data: bytes, mime_type: str, size: tuple, original_bytes: int, original_size: tuple):
+        self.data = data
+        self.mime_type = mime_type
+        self.size = size
+        self.original_bytes = original_bytes
+        self.original_size = original_size
+        self._base64 = None
+
+    @property
+    def base64(self) -> str:
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode("utf-8")
+        return self._base64
+
+    @property
+    def data_url(self) -> str:
+        """For OpenAI-compatible image_url content parts"""
+        return f"data:{self.mime_type};base64,{self.base64}"
+
+    def gemini_part(self) -> Dict:
+        """Inline blob for GenerativeModel.generate_content - sent as-is, not re-encoded"""
+        return {"mime_type": self.mime_type, "data": self.data}
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+    def report(self) -> str:
+        return (f"{self.original_size[0]}x{self.original_size[1]} {self.original_bytes / 1024:.0f} KB -> "
+                f"{self.size[0]}x{self.size[1]} {len(self.data) / 1024:.0f} KB "
+                f"({self.bytes_saved / max(self.original_bytes, 1):.0%} saved)")
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """RGB copy of the image, with any transparency composited onto white"""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+def _encode(original: bytes, max_side: int, image_format: str, quality: int) -> PreparedImage:
+    with Image.open(io.BytesIO(original)) as img:
+        original_format = img.format
+        has_exif = bool(img.info.get("exif"))
+        original_size = img.size
+        # Apply the EXIF rotation before dropping the metadata, so photos stay upright
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        resized = img.size != original_size
+        buffer = io.BytesIO()
+        # Saving without exif= drops EXIF (including GPS) from the output
+        _flatten(img).save(buffer, format=image_format, quality=quality, optimize=True)
+        data = buffer.getvalue()
+
+    # A small, clean original can beat re-encoding - keep it then
+    if not resized and not has_exif and original_format in MIME_TYPES and len(original) <= len(data):
+        return PreparedImage(original, MIME_TYPES[original_format], original_size, len(original), original_size)
+    return PreparedImage(data, MIME_TYPES[image_format], img.size, len(original), original_size)
+
+@lru_cache(maxsize=64)
+def _prepare_cached(path: str, mtime_ns: int, file_size: int,
+                    max_side: int, image_format: str, quality: int) -> PreparedImage:
+    with open(path, "rb") as f:
+        prepared = _encode(f.read(), max_side, image_format, quality)
+    _totals["images"] += 1
+    _totals["original_bytes"] += prepared.original_bytes
+    _totals["encoded_bytes"] += len(prepared.data)
+    return prepared
+
+def prepare_image(path: str, max_side: int = DEFAULT_MAX_SIDE, image_format: str = "JPEG",
+                  quality: int = DEFAULT_QUALITY) -> PreparedImage:
+    """Downscale to max_side, strip EXIF and re-encode as JPEG or WEBP
+
+    Results are cached per file (keyed on modification time and size) and settings, so
+    calling this again for the same image reuses the encoded bytes.
+    """
+    image_format = image_format.upper()
+    if image_format not in ("JPEG", "WEBP"):
+        raise ValueError(f"Unsupported output format: {image_format}")
+    stat = os.stat(path)
+    return _prepare_cached(os.path.abspath(path), stat.st_mtime_ns, stat.st_size,
+                           max_side, image_format, quality)
+
+def stats() -> Dict:
+    """Bytes saved by preprocessing in this process"""
+    saved = _totals["original_bytes"] - _totals["encoded_bytes"]
+    return {
+        **_totals,
+        "bytes_saved": saved,
+        "saved_ratio": saved / _totals["original_bytes"] if _totals["original_bytes"] else 0.0,
+        "cache": _prepare_cached.cache_info()._asdict()
+    }
@@ -0,0 +1,99 @@
+# Incremental JSON parsing for streamed model responses
+# Emits each top-level field of the response object as soon as its value is complete,
+# so scores can be shown while the rest of the answer is still streaming
+
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+# Only these characters change the parser state, so chunks are scanned between them
+_STRUCTURAL = re.compile(r'[{}\[\]",\\]')
+
+class StreamingJSONParser:
+    """Feed text chunks of one JSON object, get (field, value) pairs back as they complete
+
+    Text before the opening brace (e.g. a ```json fence) and after the closing brace is
+    ignored. Chunks are kept as a list of pieces for the current field only, so the full
+    response is never rebuilt by repeated string concatenation.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped_at = -1
+        self._offset = 0
+        self._member: List[str] = []
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk and return the top-level fields it completed"""
+        if not chunk or self.done:
+            return []
+        completed = []
+        # Start of the current field's text within this chunk, when inside the object
+        start = 0 if self._depth else None
+        for match in _STRUCTURAL.finditer(chunk):
+            index = match.start()
+            position = self._offset + index
+            char = chunk[index]
+            if self._in_string:
+                if position == self._escaped_at:
+                    continue
+                if char == "\\":
+                    self._escaped_at = position + 1
+                elif char == '"':
+                    self._in_string = False
+            elif self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                    start = index + 1
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._member.append(chunk[start:index])
+                    completed += self._finish_member()
+                    self.done = True
+                    start = None
+                    break
+            elif char == "," and self._depth == 1:
+                self._member.append(chunk[start:index])
+                completed += self._finish_member()
+                start = index + 1
+        if start is not None:
+            self._member.append(chunk[start:])
+        self._offset += len(chunk)
+        return completed
+
+    def _finish_member(self) -> List[Tuple[str, Any]]:
+        text = "".join(self._member)
+        self._member = []
+        if not text.strip():
+            return []
+        # A single `"key": value` member parses as a one-field object
+        member = json.loads("{" + text + "}")
+        self.fields.update(member)
+        return list(member.items())
+
+    def result(self) -> Dict[str, Any]:
+        """The complete object; raises ValueError if the stream ended early"""
+        if not self.done:
+            raise ValueError("Stream ended before the JSON object was complete")
+        return self.fields
+
+def stream_text(stream: Iterable) -> Iterator[str]:
+    """Text deltas from an OpenAI-compatible chat completion stream"""
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content is not None:
+            yield chunk.choices[0].delta.content
+
+def iter_fields(chunks: Iterable[str]) -> Iterator[Tuple[str, Any]]:
+    """Yield (field, value) pairs from streamed text as soon as each one is complete"""
+    parser = StreamingJSONParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    parser.result()
@@ -0,0 +1,79 @@
+# Helpers shared by the batch runners - streaming input, bounded concurrency and rate limiting
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, Union
+
+def iter_records(source: Union[str, os.PathLike, Iterable[Dict]]) -> Iterator[Dict]:
+    """Yield records one at a time from a JSONL path or any iterable of dicts"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    else:
+        yield from source
+
+async def bounded_as_completed(items: Iterable[Any],
+                               fn: Callable[[Any], Awaitable[Any]],
+                               limit: int) -> AsyncIterator[Any]:
+    """Run fn over items with at most `limit` tasks pending, yielding results as they finish
+
+    Items are pulled from the iterable lazily, so memory stays proportional to `limit`
+    rather than to the size of the input.
+    """
+    pending = set()
+    try:
+        for item in items:
+            pending.add(asyncio.ensure_future(fn(item)))
+            if len(pending) >= limit:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # Consumer stopped early or an error was raised - don't leave work running
+        for task in pending:
+            task.cancel()
+
+class RateLimiter:
+    """Async limiter that spaces calls so at most `rate` start per second"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Reserve the next slot under the lock, then sleep outside it
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+class JsonlWriter:
+    """Append records to a JSONL file, flushing each line so partial runs are kept"""
+
+    def __init__(self, path: Union[str, os.PathLike], mode: str = "w"):
+        self._file = open(path, mode, encoding="utf-8")
+
+    def write(self, record: Dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,74 @@
+# Benchmark for SimpleSearchOrchestrator.search_google - new session per query vs one pooled session
+# Runs against a local stub search server, so no SerpAPI key or network is needed
+
+import asyncio
+import statistics
+import time
+from typing import List
+
+import aiohttp
+from aiohttp import web
+
+from orchestrator import SimpleSearchOrchestrator
+
+async def stub_search(request: web.Request) -> web.Response:
+    """Mimic the shape of a SerpAPI response"""
+    query = request.query.get("q", "")
+    return web.json_response({
+        "organic_results": [
+            {"title": f"{query} result {i}", "snippet": f"Snippet {i} about {query}", "link": f"https://example.com/{i}"}
+            for i in range(3)
+        ]
+    })
+
+async def start_stub_server() -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/search", stub_search)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 8765)
+    await site.start()
+    return runner
+
+async def search_with_new_session(url: str, query: str) -> dict:
+    """Old behaviour: a fresh ClientSession (and connection) for every search"""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url, params={"q": query, "num": 3}) as response:
+            return await response.json()
+
+def summarize(label: str, latencies: List[float]):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<20} mean {statistics.mean(latencies) * 1000:6.2f}ms   "
+          f"p50 {latencies[len(latencies) // 2] * 1000:6.2f}ms   p95 {p95 * 1000:6.2f}ms")
+
+async def main():
+    runner = await start_stub_server()
+    url = "http://127.0.0.1:8765/search"
+    # 300 topics x 3 queries each, issued one at a time to isolate per-query latency
+    queries = [f"topic {t} query {q}" for t in range(300) for q in range(3)]
+
+    try:
+        fresh = []
+        for query in queries:
+            start = time.perf_counter()
+            await search_with_new_session(url, query)
+            fresh.append(time.perf_counter() - start)
+
+        pooled = []
+        async with SimpleSearchOrchestrator(search_url=url, serp_api_key="stub") as orchestrator:
+            for query in queries:
+                start = time.perf_counter()
+                await orchestrator.search_google(query)
+                pooled.append(time.perf_counter() - start)
+
+        print(f"{len(queries)} sequential searches against a local stub server\n")
+        summarize("new session/query", fresh)
+        summarize("pooled session", pooled)
+        print(f"\nSpeedup (mean): {statistics.mean(fresh) / statistics.mean(pooled):.1f}x")
+        print("Real SerpAPI calls also pay a TLS handshake per new session, so the gap is larger in production.")
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+# Benchmark for SurgeryVotingSystem - compares sequential blocking votes with concurrent async votes
+# Uses a local fake model with injected latency, so no API key or network is needed
+
+import asyncio
+import contextlib
+import io
+import json
+import random
+import time
+from typing import List, Tuple
+
+from parallelization import SurgeryVotingSystem
+
+PATIENT = {
+    "age": 45,
+    "pain_level": 8,
+    "symptom_duration": "6 months",
+    "previous_treatments": ["Physical therapy", "Epidural injections"],
+    "mri_findings": "L4-L5 disc herniation with nerve root compression",
+    "neurological_symptoms": ["Leg weakness", "Numbness in foot"]
+}
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeModel:
+    """Stand-in for genai.GenerativeModel that sleeps instead of calling the API"""
+
+    def __init__(self, latency: float, jitter: float = 0.05, recommendation: str = "surgery"):
+        self.latency = latency
+        self.jitter = jitter
+        self.recommendation = recommendation
+
+    def _response(self) -> FakeResponse:
+        return FakeResponse(json.dumps({
+            "recommendation": self.recommendation,
+            "confidence": 0.8,
+            "reasoning": ["Failed conservative treatment"],
+            "risks": ["Infection risk"],
+            "benefits": ["Pain relief"]
+        }))
+
+    def _delay(self) -> float:
+        return self.latency + random.uniform(0, self.jitter)
+
+    def generate_content(self, prompt: str) -> FakeResponse:
+        time.sleep(self._delay())
+        return self._response()
+
+    async def generate_content_async(self, prompt: str) -> FakeResponse:
+        await asyncio.sleep(self._delay())
+        return self._response()
+
+def sequential_votes(models: List[FakeModel]) -> float:
+    """Old behaviour: each blocking generate_content call runs one after another"""
+    start = time.perf_counter()
+    for model in models:
+        model.generate_content("prompt")
+    return time.perf_counter() - start
+
+async def concurrent_votes(models: List[FakeModel], max_concurrency: int) -> float:
+    voting_system = SurgeryVotingSystem(max_concurrency=max_concurrency, models=models)
+    start = time.perf_counter()
+    # Silence the per-vote debug output
+    with contextlib.redirect_stdout(io.StringIO()):
+        await voting_system.get_surgery_recommendation(PATIENT)
+    return time.perf_counter() - start
+
+async def quorum_latencies(n_voters: int, quorum: bool, runs: int) -> Tuple[List[float], int]:
+    """Per-patient latency for a clear-cut case, plus the total number of skipped votes"""
+    latencies, skipped = [], 0
+    for _ in range(runs):
+        # Wide jitter gives each patient a slow straggler, like real API tail latency
+        models = [FakeModel(0.1, jitter=0.4) for _ in range(n_voters)]
+        voting_system = SurgeryVotingSystem(max_concurrency=n_voters, models=models, quorum=quorum)
+        start = time.perf_counter()
+        result = await voting_system.get_surgery_recommendation(PATIENT, verbose=False)
+        latencies.append(time.perf_counter() - start)
+        skipped += len(result["aggregated_decision"]["skipped_votes"])
+    return latencies, skipped
+
+def p95(values: List[float]) -> float:
+    return sorted(values)[int(len(values) * 0.95) - 1]
+
+async def main():
+    latency = 0.2
+    print(f"Fake model latency: {latency * 1000:.0f}ms (+ up to 50ms jitter)\n")
+    print(f"{'voters':>6} {'limit':>6} {'sequential':>12} {'concurrent':>12} {'speedup':>8}")
+    for n_voters in (3, 5, 7):
+        for limit in sorted({1, 3, n_voters}):
+            models = [FakeModel(latency) for _ in range(n_voters)]
+            seq = sequential_votes(models)
+            conc = await concurrent_votes(models, limit)
+            print(f"{n_voters:>6} {limit:>6} {seq * 1000:>10.0f}ms {conc * 1000:>10.0f}ms {seq / conc:>7.1f}x")
+
+    runs = 40
+    print(f"\nQuorum mode, clear-cut case, {runs} patients (latency 100-500ms per vote)\n")
+    print(f"{'voters':>6} {'full p95':>10} {'quorum p95':>11} {'votes skipped':>14}")
+    for n_voters in (3, 5, 7):
+        full, _ = await quorum_latencies(n_voters, quorum=False, runs=runs)
+        early, skipped = await quorum_latencies(n_voters, quorum=True, runs=runs)
+        print(f"{n_voters:>6} {p95(full) * 1000:>8.0f}ms {p95(early) * 1000:>9.0f}ms "
+              f"{skipped:>6}/{n_voters * runs:<7}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,57 @@
+# Micro-benchmark for ModelRouter complexity heuristics on short and long (pasted code) inputs
+# Compares the old per-call scans, a single alternation regex and the precompiled matcher
+
+import re
+import timeit
+
+from routing import ModelRouter
+
+class _NoClient:
+    def gemini_model(self, model_name, *args, **kwargs):
+        return None
+
+def old_heuristics(router: ModelRouter, question: str) -> bool:
+    """Previous implementation: code-block scan, then lowercase + one re.search per pattern"""
+    if re.search(r'```[\s\S]*?```', question):
+        return True
+    lowered = question.lower()
+    for patterns in router.complex_patterns.values():
+        for pattern in patterns:
+            if re.search(pattern, lowered):
+                return True
+    return False
+
+def alternation_matcher(router: ModelRouter) -> re.Pattern:
+    """Every heuristic in one named-group alternation - the obvious single-pass design"""
+    groups = [r"(?P<code_block>```[\s\S]*?```)"] + [
+        f"(?P<{category}>{'|'.join(patterns)})"
+        for category, patterns in router.complex_patterns.items()
+    ]
+    return re.compile("|".join(groups), re.IGNORECASE)
+
+def make_inputs():
+    code_line = "    result = compute_value(items[index], offset=42)  # TODO tidy\n"
+    return {
+        "short simple": "What's the syntax for a for loop in JavaScript?",
+        "short complex": "Design a scalable microservices architecture for an e-commerce platform",
+        "50KB code, no match": "Why is this slow?\n" + code_line * 800,
+        "50KB code, fenced": "Can you look at this?\n```python\n" + code_line * 800 + "```",
+        "50KB code, match at end": "Here is my code:\n" + code_line * 800 + "Please refactor it."
+    }
+
+def main():
+    router = ModelRouter(client=_NoClient())
+    alternation = alternation_matcher(router)
+    print(f"{'input':<26} {'old':>10} {'alternation':>12} {'matcher':>10} {'speedup':>8}")
+    for label, question in make_inputs().items():
+        # All implementations must agree before timing them
+        expected = old_heuristics(router, question)
+        assert expected == bool(router._match_complexity(question)) == bool(alternation.search(question))
+        number = 2000 if len(question) < 1000 else 50
+        old = timeit.timeit(lambda: old_heuristics(router, question), number=number) / number
+        alt = timeit.timeit(lambda: alternation.search(question), number=number) / number
+        new = timeit.timeit(lambda: router._match_complexity(question), number=number) / number
+        print(f"{label:<26} {old * 1e6:>8.1f}us {alt * 1e6:>10.1f}us {new * 1e6:>8.1f}us {old / new:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
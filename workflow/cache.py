@@ -0,0 +1,299 @@
+# Caches shared by the workflows
+
+import asyncio
+import copy
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a search query so trivially different spellings share a cache entry"""
+    query = re.sub(r"\s+", " ", query.lower()).strip()
+    return query.strip(" \"'.,;:!?")
+
+class SQLiteCache:
+    """Disk-backed JSON cache with a TTL and size-bounded LRU eviction"""
+
+    def __init__(self, path: str = "cache.db", ttl: float = 24 * 3600, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None when missing or expired"""
+        row = self._conn.execute("SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or now - row[1] > self.ttl:
+            if row is not None:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self._size -= 1
+            self.misses += 1
+            return None
+        self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        self._conn.commit()
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        """Store a JSON-serializable value, evicting least recently used entries past max_entries"""
+        now = time.time()
+        exists = self._conn.execute("SELECT 1 FROM cache WHERE key = ?", (key,)).fetchone()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value, separators=(",", ":")), now, now)
+        )
+        if not exists:
+            self._size += 1
+        if self._size > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                (self._size - self.max_entries,)
+            )
+            self._size = self.max_entries
+        self._conn.commit()
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for this process plus the current entry count"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._size
+        }
+
+    def close(self):
+        self._conn.close()
+
+class MemoryCache:
+    """In-process LRU cache with an optional TTL"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = None,
+                 on_evict: Callable[[str], None] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._on_evict = on_evict
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None when missing or expired"""
+        entry = self._entries.get(key)
+        if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        del self._entries[key]
+        if self._on_evict:
+            self._on_evict(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries)
+        }
+
+def normalize_question(question: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return " ".join(re.findall(r"\w+", question.lower()))
+
+def hashed_embedding(text: str, dims: int = 1024) -> Dict[int, float]:
+    """Cheap local embedding - L2-normalized hashed bag of words and bigrams, as a sparse dict
+
+    It only compares wording, not meaning: questions that differ in one word ("production"
+    vs "staging database server") score close to 1. Fine for catching rephrasings in tests,
+    not for deciding two questions have the same answer.
+    """
+    words = normalize_question(text).split()
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector: Dict[int, float] = {}
+    for feature in features:
+        # crc32 rather than hash() so vectors are stable across processes
+        index = zlib.crc32(feature.encode("utf-8")) % dims
+        vector[index] = vector.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+    return {i: v / norm for i, v in vector.items()}
+
+def _cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(i, 0.0) for i, v in a.items())
+
+class ResponseCache:
+    """Answer cache for routed questions
+
+    Lookups try the exact question, then its normalized form and, when
+    `similarity_threshold` is set, the most similar cached question by `embed`.
+    Similarity matching is off by default: with the default hashed_embedding, questions
+    that differ by a single word can collide and get each other's answers, so only turn it
+    on with an embedding model that captures meaning. Hits are counted per model so the
+    payoff of caching each model is visible.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 3600,
+                 similarity_threshold: float = None,
+                 embed: Callable[[str], Dict[int, float]] = hashed_embedding):
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed
+        self._vectors: Dict[str, Dict[int, float]] = {}
+        self._entries = MemoryCache(max_entries, ttl, on_evict=lambda key: self._vectors.pop(key, None))
+        self.lookups = 0
+        self.model_stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, model: str, field: str):
+        stats = self.model_stats.setdefault(model, {"hits": 0, "stores": 0})
+        stats[field] += 1
+
+    def get(self, question: str) -> Optional[Dict]:
+        """Return the cached entry (with a `cache_match` field) or None"""
+        self.lookups += 1
+        key = normalize_question(question)
+        entry = self._entries.get(key)
+        match = None
+        if entry is not None:
+            match = "exact" if entry["question"] == question else "normalized"
+        elif self.similarity_threshold is not None and self._vectors:
+            vector = self.embed(question)
+            scores = sorted(((_cosine(vector, v), k) for k, v in self._vectors.items()), reverse=True)
+            # The closest match may have expired - fall through to the next one that hasn't
+            for score, candidate in scores:
+                if score < self.similarity_threshold:
+                    break
+                entry = self._entries.get(candidate)
+                if entry is not None:
+                    match = "similar"
+                    break
+        if entry is None:
+            return None
+        self._count(entry["model_used"], "hits")
+        return {**entry, "cache_match": match}
+
+    def set(self, question: str, entry: Dict):
+        """Store an entry; it must contain `model_used`"""
+        key = normalize_question(question)
+        self._entries.set(key, {**entry, "question": question})
+        if self.similarity_threshold is not None:
+            self._vectors[key] = self.embed(question)
+        self._count(entry["model_used"], "stores")
+
+    def stats(self) -> Dict:
+        hits = sum(s["hits"] for s in self.model_stats.values())
+        return {
+            "lookups": self.lookups,
+            "hits": hits,
+            "hit_rate": hits / self.lookups if self.lookups else 0.0,
+            "entries": len(self._entries),
+            "by_model": {
+                model: {**s, "hit_rate": s["hits"] / (s["hits"] + s["stores"]) if s["hits"] + s["stores"] else 0.0}
+                for model, s in self.model_stats.items()
+            }
+        }
+
+# Handed to coalesced waiters when the computing task is cancelled
+_RETRY = object()
+
+class StepCache:
+    """Content-addressed cache for pipeline step outputs
+
+    Keys hash the step name, its inputs as canonical JSON, the model name and the step's
+    prompt version, so equal inputs share an entry however they were built. Values live in
+    any backend with get/set - MemoryCache or SQLiteCache - which handles eviction.
+    Concurrent computations of the same key are coalesced into one call.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else MemoryCache()
+        self.coalesced = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def key(step: str, inputs: Any, model_name: str, prompt_version: int) -> str:
+        canonical = json.dumps([step, inputs, model_name, prompt_version],
+                               sort_keys=True, separators=(",", ":"), default=str)
+        return f"{step}:{hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()}"
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Tuple[Any, bool]]]) -> Any:
+        """Return the cached value for key, or await compute() -> (value, cacheable) and store it
+
+        Values are copied on the way in and out so callers can mutate what they get back.
+        """
+        while True:
+            value = self.backend.get(key)
+            if value is not None:
+                return copy.deepcopy(value)
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            value = await asyncio.shield(pending)
+            if value is _RETRY:
+                # The computing task was cancelled, not us - compute it again (or join whoever does)
+                continue
+            self.coalesced += 1
+            return copy.deepcopy(value)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value, cacheable = await compute()
+        except asyncio.CancelledError:
+            future.set_result(_RETRY)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception retrieved when nobody else was waiting on it
+            future.exception()
+            raise
+        else:
+            if cacheable:
+                self.backend.set(key, copy.deepcopy(value))
+            future.set_result(value)
+            return value
+        finally:
+            del self._pending[key]
+
+    def stats(self) -> Dict:
+        return {**self.backend.stats(), "coalesced": self.coalesced}
@@ -0,0 +1,96 @@
+# Bounded history for long-running chains and orchestrators
+# Recent records stay in memory, everything else can be spilled to a gzip JSONL file
+
+import gzip
+import hashlib
+import json
+import queue
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List
+
+# Fields that hold prompts and model output - the bulk of every record
+TEXT_FIELDS = ("prompt", "response", "synthesis")
+
+def text_digest(value: Any) -> Dict:
+    """Stand-in for a large field: a stable hash plus its size"""
+    text = value if isinstance(value, str) else json.dumps(value, sort_keys=True, default=str)
+    return {
+        "blake2b": hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest(),
+        "chars": len(text)
+    }
+
+class HistorySink:
+    """Ring buffer of the last `max_entries` history records
+
+    With hash_text, the fields in `text_fields` (at the top level or one level down, e.g.
+    inside "details") are replaced by text_digest before they are kept. With spill_path,
+    each full record is also handed to a background thread that appends it to a gzip JSONL
+    file; the hand-off queue is bounded and records are dropped (and counted) rather than
+    blocking the caller when the disk can't keep up. Iterates like the list it replaces.
+    """
+
+    def __init__(self, max_entries: int = 1000, hash_text: bool = False,
+                 text_fields: Iterable[str] = TEXT_FIELDS, spill_path: str = None,
+                 spill_queue_size: int = 10000):
+        self.hash_text = hash_text
+        self.text_fields = set(text_fields)
+        self.appended = 0
+        self.dropped = 0
+        self._records: deque = deque(maxlen=max_entries)
+        self._spill_queue: "queue.Queue" = None
+        self._spill_thread: threading.Thread = None
+        if spill_path is not None:
+            self._spill_queue = queue.Queue(maxsize=spill_queue_size)
+            self._spill_thread = threading.Thread(target=self._spill, args=(spill_path,), daemon=True)
+            self._spill_thread.start()
+
+    def _compact(self, record: Dict) -> Dict:
+        compact = {}
+        for key, value in record.items():
+            if key in self.text_fields:
+                value = text_digest(value)
+            elif isinstance(value, dict):
+                value = {k: text_digest(v) if k in self.text_fields else v for k, v in value.items()}
+            compact[key] = value
+        return compact
+
+    def append(self, record: Dict):
+        self.appended += 1
+        if self._spill_queue is not None:
+            try:
+                self._spill_queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+        self._records.append(self._compact(record) if self.hash_text else record)
+
+    def _spill(self, path: str):
+        # gzip streams can be concatenated, so appending keeps earlier runs readable
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            while True:
+                record = self._spill_queue.get()
+                if record is None:
+                    return
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def close(self):
+        """Flush spilled records to disk and stop the writer thread"""
+        if self._spill_thread is not None:
+            self._spill_queue.put(None)
+            self._spill_thread.join()
+            self._spill_thread = None
+
+    def stats(self) -> Dict:
+        return {"appended": self.appended, "kept": len(self._records), "dropped": self.dropped}
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __getitem__(self, index: int) -> Dict:
+        return self._records[index]
+
+    def to_list(self) -> List[Dict]:
+        return list(self._records)
@@ -0,0 +1,215 @@
+# JSON extraction and validation for model responses
+# One place to pull JSON out of chatty or fenced output, check it against a TypedDict
+# and count how often responses needed repairing or could not be used at all
+
+import json
+import re
+from collections import Counter
+from typing import Any, Dict, List, Literal, Optional, Union, get_args, get_origin, get_type_hints
+
+try:
+    # Also recognizes typing_extensions.TypedDict, which typing.is_typeddict misses before 3.13
+    from typing_extensions import is_typeddict
+except ImportError:
+    from typing import is_typeddict
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # orjson is optional - the stdlib parser gives the same results, slower
+    _loads = json.loads
+
+class ModelOutputError(ValueError):
+    """A model response that could not be turned into the expected JSON"""
+
+class JSONExtractionError(ModelOutputError):
+    """No parseable JSON object or array in the response"""
+
+class SchemaValidationError(ModelOutputError):
+    """JSON was found but doesn't match the schema"""
+
+    def __init__(self, errors: List[str], value: Any):
+        super().__init__("; ".join(errors[:5]))
+        self.errors = errors
+        self.value = value
+
+_FENCE = re.compile(r"```[a-zA-Z]*[ \t]*\n?(.*?)```", re.DOTALL)
+# Only these characters matter for bracket matching, so the scanner jumps between them
+_STRUCTURAL = re.compile(r'[{}\[\]"\\]')
+_OPENERS = {"object": re.compile(r"\{"), "array": re.compile(r"\["), None: re.compile(r"[{\[]")}
+_CLOSERS = {"{": "}", "[": "]"}
+
+# label -> outcome counts: direct, fenced, extracted (repaired) and failed / invalid
+_stats: Dict[str, Counter] = {}
+
+def _record(label: str, outcome: str):
+    _stats.setdefault(label, Counter())[outcome] += 1
+
+def _balanced_end(text: str, start: int, end: int) -> int:
+    """Index just past the value opened at text[start], or -1 if brackets don't balance"""
+    stack = []
+    in_string = False
+    escaped_at = -1
+    for match in _STRUCTURAL.finditer(text, start, end):
+        position = match.start()
+        char = text[position]
+        if in_string:
+            if position == escaped_at:
+                continue
+            if char == "\\":
+                escaped_at = position + 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append(_CLOSERS[char])
+        elif char in "}]":
+            if not stack or stack.pop() != char:
+                return -1
+            if not stack:
+                return position + 1
+    return -1
+
+def _scan(text: str, start: int, end: int, expect: Optional[str], max_attempts: int) -> Any:
+    """Parse the first balanced object/array in text[start:end] that is valid JSON"""
+    opener = _OPENERS[expect]
+    for _ in range(max_attempts):
+        match = opener.search(text, start, end)
+        if match is None:
+            break
+        value_end = _balanced_end(text, match.start(), end)
+        if value_end != -1:
+            try:
+                return _loads(text[match.start():value_end])
+            except ValueError:
+                pass
+        start = match.start() + 1
+    raise JSONExtractionError("No JSON found in response")
+
+def _looks_like_json(text: str, start: int, end: int) -> bool:
+    # Cheap check on the first and last non-space characters before trying a full parse
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return end > start and text[start] in "{[" and text[end - 1] in "}]"
+
+def extract_json(text: str, expect: Optional[str] = None, label: str = "default",
+                 max_attempts: int = 5) -> Any:
+    """Return the JSON value in a model response
+
+    Tries, in order: the whole text, the first ``` fenced block, then a single scan for the
+    first balanced {...} or [...] (`expect` = "object" or "array" restricts which). Raises
+    JSONExtractionError when nothing parses.
+    """
+    if _looks_like_json(text, 0, len(text)):
+        try:
+            value = _loads(text)
+            _record(label, "direct")
+            return value
+        except ValueError:
+            pass
+
+    start, end = 0, len(text)
+    fence = _FENCE.search(text)
+    if fence is not None:
+        start, end = fence.span(1)
+        if _looks_like_json(text, start, end):
+            try:
+                value = _loads(text[start:end])
+                _record(label, "fenced")
+                return value
+            except ValueError:
+                pass
+    try:
+        value = _scan(text, start, end, expect, max_attempts)
+    except JSONExtractionError:
+        if fence is None:
+            _record(label, "failed")
+            raise
+        # The fenced block was something else (e.g. an example) - look at the whole text
+        try:
+            value = _scan(text, 0, len(text), expect, max_attempts)
+        except JSONExtractionError:
+            _record(label, "failed")
+            raise
+    _record(label, "extracted")
+    return value
+
+def validate(value: Any, schema: Any, path: str = "$") -> List[str]:
+    """Errors from checking value against a type hint or TypedDict (empty when it matches)
+
+    Extra keys are allowed; ints are accepted where floats are expected.
+    """
+    if schema is Any:
+        return []
+    if is_typeddict(schema):
+        if not isinstance(value, dict):
+            return [f"{path}: expected object, got {type(value).__name__}"]
+        errors = [f"{path}.{key}: missing" for key in schema.__required_keys__ if key not in value]
+        for key, hint in get_type_hints(schema).items():
+            if key in value:
+                errors += validate(value[key], hint, f"{path}.{key}")
+        return errors
+
+    origin, args = get_origin(schema), get_args(schema)
+    if origin is Union:
+        branch_errors = [validate(value, arg, path) for arg in args]
+        return [] if any(not e for e in branch_errors) else branch_errors[0]
+    if origin is Literal:
+        return [] if value in args else [f"{path}: expected one of {list(args)}, got {value!r}"]
+    if origin in (list, List):
+        if not isinstance(value, list):
+            return [f"{path}: expected array, got {type(value).__name__}"]
+        item_type = args[0] if args else Any
+        return [error for i, item in enumerate(value) for error in validate(item, item_type, f"{path}[{i}]")]
+    if origin in (dict, Dict):
+        if not isinstance(value, dict):
+            return [f"{path}: expected object, got {type(value).__name__}"]
+        value_type = args[1] if args else Any
+        return [error for key, item in value.items() for error in validate(item, value_type, f"{path}.{key}")]
+
+    if schema is type(None):
+        return [] if value is None else [f"{path}: expected null"]
+    if schema is float:
+        ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+    elif schema is int:
+        ok = isinstance(value, int) and not isinstance(value, bool)
+    else:
+        ok = isinstance(value, schema)
+    return [] if ok else [f"{path}: expected {schema.__name__}, got {type(value).__name__}"]
+
+def parse_json(text: str, schema: Any = None, label: str = "default") -> Any:
+    """extract_json plus validation against `schema`
+
+    Raises JSONExtractionError or SchemaValidationError - both ModelOutputError.
+    """
+    expect = None
+    if schema is not None:
+        is_list = get_origin(schema) in (list, List)
+        is_object = is_typeddict(schema) or get_origin(schema) in (dict, Dict)
+        expect = "array" if is_list else "object" if is_object else None
+    value = extract_json(text, expect=expect, label=label)
+    if schema is not None:
+        errors = validate(value, schema)
+        if errors:
+            _record(label, "invalid")
+            raise SchemaValidationError(errors, value)
+    return value
+
+def extraction_stats() -> Dict[str, Dict]:
+    """Per-label outcome counts with repair and failure rates"""
+    report = {}
+    for label, counts in _stats.items():
+        parsed = counts["direct"] + counts["fenced"] + counts["extracted"]
+        total = parsed + counts["failed"]
+        report[label] = {
+            **counts,
+            "repair_rate": (counts["fenced"] + counts["extracted"]) / total if total else 0.0,
+            "failure_rate": (counts["failed"] + counts["invalid"]) / total if total else 0.0
+        }
+    return report
+
+def reset_stats():
+    _stats.clear()
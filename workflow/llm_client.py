@@ -0,0 +1,218 @@
+# Shared LLM client layer used by every workflow
+# Providers are configured once per process, connections are pooled, calls are async
+# and each provider gets its own concurrency limit plus retries with jittered backoff
+
+import asyncio
+import json
+import os
+import random
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import google.generativeai as genai
+import httpx
+import openai
+from dotenv import load_dotenv
+from google.api_core import exceptions as google_exceptions
+
+load_dotenv()
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+XAI_API_KEY = os.getenv('XAI_API_KEY')
+XAI_BASE_URL = "https://api.x.ai/v1"
+
+# Errors worth retrying: rate limits, timeouts and transient server/connection failures
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+DEFAULT_CONCURRENCY = {
+    "gemini": 16,
+    "xai": 8
+}
+
+_gemini_configured = False
+
+def configure_gemini(api_key: str = GEMINI_API_KEY):
+    """Set the Gemini API key for the whole process
+
+    genai keeps one global configuration, so this changes the key used by every
+    LLMClient and GenerativeModel in the process, not just the caller's.
+    """
+    global _gemini_configured
+    genai.configure(api_key=api_key)
+    _gemini_configured = True
+
+class LLMClient:
+    """Process-wide access to Gemini and xAI with pooling, retries and concurrency limits
+
+    The Gemini key is process-wide (see configure_gemini); the xAI key is per client.
+    """
+
+    def __init__(self,
+                 xai_api_key: str = XAI_API_KEY,
+                 concurrency: Dict[str, int] = None,
+                 max_retries: int = 3,
+                 base_delay: float = 0.5,
+                 max_delay: float = 8.0,
+                 timeout: float = 60.0):
+        # genai keeps one gRPC channel per process, so configure it only if nobody has yet
+        if not _gemini_configured:
+            configure_gemini()
+        self.xai_api_key = xai_api_key
+        self.concurrency = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self._models: Dict[str, genai.GenerativeModel] = {}
+        # Semaphores and the httpx pool belong to an event loop, so they are built lazily
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._xai: Optional[openai.AsyncOpenAI] = None
+        self._xai_guard: Optional[asyncio.Task] = None
+
+    def gemini_model(self, model_name: str, generation_config: Dict = None, **kwargs) -> genai.GenerativeModel:
+        """Return a shared GenerativeModel for this name and config"""
+        key = json.dumps([model_name, generation_config, kwargs], sort_keys=True, default=str)
+        if key not in self._models:
+            self._models[key] = genai.GenerativeModel(model_name, generation_config=generation_config, **kwargs)
+        return self._models[key]
+
+    def _bind_loop(self):
+        """Reset loop-bound resources when called from a new event loop (e.g. a second asyncio.run)"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # A pool from a loop that is still open is closed there; one from a finished
+            # asyncio.run was already closed by its guard when that loop shut down
+            if self._xai_guard is not None and not self._loop.is_closed():
+                self._loop.call_soon_threadsafe(self._xai_guard.cancel)
+            self._loop = loop
+            self._semaphores = {
+                provider: asyncio.Semaphore(limit)
+                for provider, limit in self.concurrency.items()
+            }
+            self._xai = None
+            self._xai_guard = None
+
+    @property
+    def xai(self) -> openai.AsyncOpenAI:
+        """Async OpenAI-compatible client for the xAI endpoint on a pooled keep-alive connection"""
+        self._bind_loop()
+        if self._xai is None:
+            limit = self.concurrency["xai"]
+            self._xai = openai.AsyncOpenAI(
+                api_key=self.xai_api_key,
+                base_url=XAI_BASE_URL,
+                # Retries are handled by _with_retries so the backoff policy is shared
+                max_retries=0,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+                    timeout=self.timeout
+                )
+            )
+            self._xai_guard = self._loop.create_task(self._close_on_shutdown(self._xai))
+        return self._xai
+
+    @staticmethod
+    async def _close_on_shutdown(xai: openai.AsyncOpenAI):
+        """Close the pool once cancelled - asyncio.run cancels leftover tasks before closing
+        the loop, so connections are released on the loop that owns them"""
+        try:
+            await asyncio.Future()
+        finally:
+            await xai.close()
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps concurrent callers from retrying in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def _with_retries(self, provider: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        self._bind_loop()
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphores[provider]:
+                    return await call()
+            except RETRYABLE_ERRORS:
+                if attempt == self.max_retries:
+                    raise
+            # Sleep outside the semaphore so waiting retries don't hold a slot
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def generate(self, model: genai.GenerativeModel, contents: Any, **kwargs) -> Any:
+        """Async generate_content on a Gemini model"""
+        return await self._with_retries("gemini", lambda: model.generate_content_async(contents, **kwargs))
+
+    async def stream(self, model: genai.GenerativeModel, contents: Any, **kwargs) -> AsyncIterator[str]:
+        """Async stream of text chunks from a Gemini model
+
+        Retries only happen before the first chunk - once text has been yielded, a retry would
+        repeat it, so later errors are raised to the caller.
+        """
+        self._bind_loop()
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                # The slot is held for the whole stream, since the connection is busy until it ends
+                async with self._semaphores["gemini"]:
+                    response = await model.generate_content_async(contents, stream=True, **kwargs)
+                    async for chunk in response:
+                        # Chunks without parts (e.g. the final usage chunk) have no text
+                        if chunk.parts:
+                            started = True
+                            yield chunk.text
+                return
+            except RETRYABLE_ERRORS:
+                if started or attempt == self.max_retries:
+                    raise
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def chat(self, **kwargs) -> Any:
+        """Async chat completion against the xAI endpoint"""
+        return await self._with_retries("xai", lambda: self.xai.chat.completions.create(**kwargs))
+
+    async def stream_chat(self, **kwargs) -> AsyncIterator[str]:
+        """Async stream of text deltas from an xAI chat completion
+
+        Retried like stream: only before the first delta, since later errors would repeat text.
+        """
+        self._bind_loop()
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                async with self._semaphores["xai"]:
+                    response = await self.xai.chat.completions.create(stream=True, **kwargs)
+                    # Closing the response releases the pooled connection if the caller stops early
+                    async with response:
+                        async for chunk in response:
+                            # Role-only and usage chunks carry no content
+                            if chunk.choices and chunk.choices[0].delta.content is not None:
+                                started = True
+                                yield chunk.choices[0].delta.content
+                return
+            except RETRYABLE_ERRORS:
+                if started or attempt == self.max_retries:
+                    raise
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def aclose(self):
+        """Close pooled HTTP connections"""
+        if self._xai is not None:
+            self._xai_guard.cancel()
+            await self._xai.close()
+            self._xai = None
+            self._xai_guard = None
+
+_default_client: Optional[LLMClient] = None
+
+def get_client() -> LLMClient:
+    """Return the process-wide client, creating it on first use"""
+    global _default_client
+    if _default_client is None:
+        _default_client = LLMClient()
+    return _default_client
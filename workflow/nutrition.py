@@ -0,0 +1,227 @@
+# Local nutrition calculator - replaces the LLM round-trip in MealPlanChain.analyze_requirements
+# BMR from Mifflin-St Jeor, TDEE from activity multipliers, macros from goal-based rules
+
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+ACTIVITY_MULTIPLIERS = {
+    "sedentary": 1.2,
+    "light": 1.375,
+    "moderate": 1.55,
+    "active": 1.725,
+    "very active": 1.725,
+    "extra active": 1.9,
+    "athlete": 1.9
+}
+
+# Goal -> calorie adjustment vs TDEE, protein g/kg bodyweight, meals per day
+GOAL_PROFILES = {
+    "lose": {"calorie_factor": 0.8, "protein_per_kg": 2.2, "meal_frequency": 3},
+    "gain": {"calorie_factor": 1.1, "protein_per_kg": 2.0, "meal_frequency": 4},
+    "maintain": {"calorie_factor": 1.0, "protein_per_kg": 1.6, "meal_frequency": 3}
+}
+
+GOAL_KEYWORDS = {
+    "lose": ["lose", "loss", "cut", "slim", "shred"],
+    "gain": ["build", "muscle", "gain", "bulk", "mass", "strength"]
+}
+
+MICRONUTRIENT_FOCUS = {
+    "lose": ["Fiber", "Calcium", "Iron"],
+    "gain": ["Vitamin D", "Magnesium", "Zinc"],
+    "maintain": ["Vitamin D", "Iron"]
+}
+
+# Restrictions we can describe without a model, with the nutrients they put at risk
+KNOWN_RESTRICTIONS = {
+    "vegan": ("Plant-based diet - plan complete proteins from legumes, soy and grains", ["Vitamin B12", "Iron", "Omega-3"]),
+    "vegetarian": ("Vegetarian diet - include eggs, dairy or legumes at each meal for protein", ["Vitamin B12", "Iron"]),
+    "gluten": ("Gluten-free - use rice, quinoa, potatoes and certified gluten-free oats", ["Fiber", "B Vitamins"]),
+    "dairy": ("Dairy-free - use fortified plant milks for calcium", ["Calcium", "Vitamin D"]),
+    "lactose": ("Lactose-free - use lactose-free dairy or fortified plant milks", ["Calcium"]),
+    "nut": ("Nut allergy - avoid nuts and nut oils, check labels for cross-contamination", []),
+    "peanut": ("Peanut allergy - avoid peanuts and peanut oil, check labels for cross-contamination", []),
+    "shellfish": ("Shellfish allergy - avoid shellfish, use other lean proteins", []),
+    "keto": ("Ketogenic diet - keep carbohydrates very low and fats high", ["Magnesium", "Potassium"]),
+    "halal": ("Halal - use halal-certified meat", []),
+    "kosher": ("Kosher - use kosher-certified products", [])
+}
+
+# Entries that mean "nothing to consider"
+EMPTY_ENTRIES = {"", "none", "n/a", "na", "no", "nothing"}
+
+def parse_weight_kg(weight) -> float:
+    """Parse "150lbs", "150 lb", "68kg" or a bare number (pounds) into kilograms"""
+    if isinstance(weight, (int, float)):
+        return float(weight) * 0.453592
+    return _parse_weight_text(str(weight).lower())
+
+# Measurements repeat across a cohort, so parsed text is memoized
+@lru_cache(maxsize=4096)
+def _parse_weight_text(weight: str) -> float:
+    match = re.match(r"\s*([\d.]+)\s*(kg|kgs|kilograms?|lb|lbs|pounds?)?\s*$", weight)
+    if not match:
+        raise ValueError(f"Unrecognized weight: {weight!r}")
+    value, unit = float(match.group(1)), match.group(2) or "lb"
+    return value if unit.startswith("k") else value * 0.453592
+
+def parse_height_cm(height) -> float:
+    """Parse "5'10", "5 ft 10 in", "178cm", "1.78m" or "70in" into centimeters"""
+    return _parse_height_text(str(height).lower().strip())
+
+@lru_cache(maxsize=4096)
+def _parse_height_text(text: str) -> float:
+    feet = re.match(r"^(\d+)\s*(?:'|ft|feet|foot)\s*(?:(\d+(?:\.\d+)?)\s*(?:\"|''|in|inches)?)?$", text)
+    if feet:
+        return (int(feet.group(1)) * 12 + float(feet.group(2) or 0)) * 2.54
+    match = re.match(r"^([\d.]+)\s*(cm|m|in|inches)?$", text)
+    if not match:
+        raise ValueError(f"Unrecognized height: {text!r}")
+    value, unit = float(match.group(1)), match.group(2)
+    if unit is None:
+        # Guess the unit from the magnitude
+        unit = "m" if value < 3 else "in" if value < 100 else "cm"
+    return {"cm": value, "m": value * 100, "in": value * 2.54, "inches": value * 2.54}[unit]
+
+def activity_multiplier(activity_level: str) -> float:
+    return _activity_multiplier(str(activity_level).lower())
+
+@lru_cache(maxsize=256)
+def _activity_multiplier(level: str) -> float:
+    # Longest key first so "very active" wins over "active"
+    for key in sorted(ACTIVITY_MULTIPLIERS, key=len, reverse=True):
+        if key in level:
+            return ACTIVITY_MULTIPLIERS[key]
+    return ACTIVITY_MULTIPLIERS["moderate"]
+
+def goal_type(goals) -> str:
+    text = " ".join(goals) if isinstance(goals, list) else str(goals)
+    return _goal_type(text.lower())
+
+@lru_cache(maxsize=1024)
+def _goal_type(text: str) -> str:
+    for goal, keywords in GOAL_KEYWORDS.items():
+        if any(keyword in text for keyword in keywords):
+            return goal
+    return "maintain"
+
+def _mentions(key: str, text: str) -> bool:
+    """True if any word in text starts with key - "nuts" matches "nut", "peanut" does not"""
+    return any(word.startswith(key) for word in re.findall(r"[a-z]+", text))
+
+# Batches repeat the same few restriction strings, so each is tokenized once
+@lru_cache(maxsize=1024)
+def _restriction_effects(text: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """(considerations, nutrients at risk) for one lowercased restriction entry"""
+    words = re.findall(r"[a-z]+", text)
+    considerations, nutrients = [], []
+    for key, (consideration, at_risk) in KNOWN_RESTRICTIONS.items():
+        if any(word.startswith(key) for word in words):
+            considerations.append(consideration)
+            nutrients.extend(at_risk)
+    return tuple(considerations), tuple(nutrients)
+
+def _as_list(value) -> List[str]:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+def free_text_entries(user_input: Dict) -> List[str]:
+    """Restrictions/health conditions that the local tables don't understand"""
+    unknown = []
+    for entry in _as_list(user_input.get("restrictions")) + _as_list(user_input.get("health_conditions")):
+        text = str(entry).strip().lower()
+        if text in EMPTY_ENTRIES:
+            continue
+        if not any(_mentions(key, text) for key in KNOWN_RESTRICTIONS) or len(text.split()) > 3:
+            unknown.append(str(entry))
+    return unknown
+
+def _parse_measurements(user_input: Dict) -> Tuple[float, float, float, float, float, str]:
+    """(age, weight_kg, height_cm, sex offset, activity multiplier, goal) for one user
+
+    Raises ValueError when age, weight or height can't be parsed.
+    """
+    try:
+        age = float(user_input["age"])
+    except TypeError:
+        raise ValueError(f"Unrecognized age: {user_input['age']!r}") from None
+    weight_kg = parse_weight_kg(user_input["weight"])
+    height_cm = parse_height_cm(user_input["height"])
+    # Mifflin-St Jeor; without a stated sex use the midpoint of the male (+5) and female (-161) offsets
+    sex = str(user_input.get("sex", user_input.get("gender", ""))).lower()
+    offset = 5 if sex.startswith("m") else -161 if sex.startswith("f") else -78
+    multiplier = activity_multiplier(user_input.get("activity_level", "moderate"))
+    return age, weight_kg, height_cm, offset, multiplier, goal_type(user_input.get("goals", ""))
+
+def _energy(age, weight_kg, height_cm, offset, multiplier, calorie_factor, protein_per_kg):
+    """Calories and macro grams - works on floats or on numpy arrays of many users"""
+    bmr = 10 * weight_kg + 6.25 * height_cm - 5 * age + offset
+    calories = bmr * multiplier * calorie_factor
+    protein = weight_kg * protein_per_kg
+    fats = calories * 0.25 / 9
+    carbs = np.maximum(0.0, (calories - protein * 4 - fats * 9) / 4)
+    return calories, protein, fats, carbs
+
+def _requirements(user_input: Dict, goal: str, calories: int, protein: int, carbs: int, fats: int) -> Dict:
+    micronutrients = list(MICRONUTRIENT_FOCUS[goal])
+    considerations = []
+    for entry in _as_list(user_input.get("restrictions")) + _as_list(user_input.get("health_conditions")):
+        entry_considerations, nutrients = _restriction_effects(str(entry).lower())
+        considerations.extend(entry_considerations)
+        micronutrients.extend(nutrients)
+
+    return {
+        "daily_calories": calories,
+        "macronutrient_split": {
+            "protein": protein,
+            "carbs": carbs,
+            "fats": fats
+        },
+        "micronutrient_focus": list(dict.fromkeys(micronutrients)),
+        "meal_frequency": GOAL_PROFILES[goal]["meal_frequency"],
+        "dietary_considerations": considerations
+    }
+
+def calculate_requirements(user_input: Dict) -> Dict:
+    """Daily requirements in the same schema analyze_requirements returns
+
+    Raises ValueError when age, weight or height can't be parsed.
+    """
+    age, weight_kg, height_cm, offset, multiplier, goal = _parse_measurements(user_input)
+    profile = GOAL_PROFILES[goal]
+    calories, protein, fats, carbs = _energy(age, weight_kg, height_cm, offset, multiplier,
+                                             profile["calorie_factor"], profile["protein_per_kg"])
+    return _requirements(user_input, goal, round(calories), round(protein), round(float(carbs)), round(fats))
+
+def calculate_requirements_batch(user_inputs: List[Dict]) -> List[Optional[Dict]]:
+    """calculate_requirements for many users; None where inputs can't be parsed
+
+    Only the text parsing is per user - the energy and macro math runs once over numpy
+    arrays of the whole batch.
+    """
+    parsed = []
+    for user_input in user_inputs:
+        try:
+            parsed.append(_parse_measurements(user_input))
+        except (KeyError, ValueError):
+            parsed.append(None)
+    rows = [(i, p) for i, p in enumerate(parsed) if p is not None]
+    results: List[Optional[Dict]] = [None] * len(user_inputs)
+    if not rows:
+        return results
+
+    age, weight_kg, height_cm, offset, multiplier = np.array([p[:5] for _, p in rows], dtype=float).T
+    goals = [p[5] for _, p in rows]
+    calorie_factor = np.array([GOAL_PROFILES[goal]["calorie_factor"] for goal in goals])
+    protein_per_kg = np.array([GOAL_PROFILES[goal]["protein_per_kg"] for goal in goals])
+    energy = _energy(age, weight_kg, height_cm, offset, multiplier, calorie_factor, protein_per_kg)
+    # np.rint rounds half to even like round(), so batch and single results match
+    calories, protein, fats, carbs = (np.rint(values).astype(int).tolist() for values in energy)
+
+    for j, (i, _) in enumerate(rows):
+        results[i] = _requirements(user_inputs[i], goals[j], calories[j], protein[j], carbs[j], fats[j])
+    return results
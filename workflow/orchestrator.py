@@ -1,25 +1,99 @@
-import google.generativeai as genai
-from typing import Dict, List, Any
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, TypedDict
 import json
 from datetime import datetime
 from dotenv import load_dotenv
 import os
 import asyncio
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 import aiohttp
 
+from cache import SQLiteCache, normalize_query
+from history import HistorySink
+from json_extract import ModelOutputError, parse_json
+from llm_client import LLMClient, get_client
+
 load_dotenv()
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 SERP_API_KEY = os.getenv('SERP_API_KEY')
+SERP_API_URL = "https://serpapi.com/search"
+
+class Synthesis(TypedDict):
+    key_findings: List[str]
+    current_applications: List[str]
+    future_implications: List[str]
+    sources: List[str]
 
 #    Search Topic -> Generate 3 Queries -> Execute 3 Searches -> Aggregate Results -> Display Results
 
+# Marks the end of the stream flowing through a pipeline queue
+_DONE = object()
+
+def _normalize_url(url: str) -> str:
+    """Canonical URL for duplicate detection - ignores scheme, www., fragments, tracking params and trailing /"""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query) if not k.startswith("utm_")])
+    return urlunsplit(("", host, parts.path.rstrip("/"), query, ""))
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = re.findall(r"\w+", text.lower())
+    return {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting English text
+    return len(text) // 4 + 1
+
 class SimpleSearchOrchestrator:
     """Simple orchestrator that handles 3 search queries and aggregates results"""
     
-    def __init__(self):
-        genai.configure(api_key=GEMINI_API_KEY)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
-        self.history = []
+    def __init__(self, client: LLMClient = None, search_url: str = SERP_API_URL, serp_api_key: str = SERP_API_KEY,
+                 max_connections: int = 20, cache: SQLiteCache = None, context_token_budget: int = 1500,
+                 near_duplicate_threshold: float = 0.8, history: HistorySink = None):
+        self.client = client or get_client()
+        self.model = self.client.gemini_model('gemini-1.5-flash')
+        # Bounded so long-lived workers don't grow without limit; pass a sink to hash or spill
+        self.history = history if history is not None else HistorySink()
+        self.search_url = search_url
+        self.serp_api_key = serp_api_key
+        # Optional persistent cache of search results keyed by normalized query
+        self.cache = cache
+        # Limits on how much search context goes into the synthesis prompt
+        self.context_token_budget = context_token_budget
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.max_connections = max_connections
+        # One long-lived HTTP session for all searches, created on first use
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self):
+        self._get_session()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared search session, creating it if needed"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections,  # every search hits the same host
+                ttl_dns_cache=300,
+                keepalive_timeout=30
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        return self._session
+
+    async def close(self):
+        """Close the search session and its pooled connections"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
     def _log_action(self, action: str, details: Dict):
         """Log orchestrator actions"""
@@ -42,23 +116,16 @@ class SimpleSearchOrchestrator:
         ["query1", "query2", "query3"]
         """
         
-        response = self.model.generate_content(prompt)
+        response = await self.client.generate(self.model, prompt)
         try:
-            # Extract JSON from response
-            response_text = response.text.strip()
-            if response_text.startswith('```json'):
-                response_text = response_text[7:-3]
-            elif response_text.startswith('```'):
-                response_text = response_text[3:-3]
-            
-            queries = json.loads(response_text)
+            queries = parse_json(response.text, List[str], label="search_queries")
             self._log_action("query_generation", {
                 "topic": topic,
                 "queries": queries
             })
             return queries[:3]  # Ensure we only get 3 queries
-        except json.JSONDecodeError:
-            print(f"Failed to parse queries. Response: {response_text}")
+        except ModelOutputError:
+            print(f"Failed to parse queries. Response: {response.text}")
             # Return default queries
             return [
                 f"{topic} latest developments",
@@ -68,24 +135,38 @@ class SimpleSearchOrchestrator:
 
     async def search_google(self, query: str) -> Dict:
         """Perform a single Google search"""
+        cache_key = f"serp:3:{normalize_query(query)}"
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self._log_action("search_cache_hit", {
+                    "query": query,
+                    "results_count": len(cached)
+                })
+                return {
+                    "query": query,
+                    "results": cached
+                }
         try:
-            async with aiohttp.ClientSession() as session:
-                params = {
-                    "api_key": SERP_API_KEY,
-                    "q": query,
-                    "num": 3  # Get 3 results per query
+            params = {
+                "api_key": self.serp_api_key,
+                "q": query,
+                "num": 3  # Get 3 results per query
+            }
+            async with self._get_session().get(self.search_url, params=params) as response:
+                data = await response.json()
+                results = data.get("organic_results", [])
+                self._log_action("search_execution", {
+                    "query": query,
+                    "results_count": len(results)
+                })
+                # Only cache real answers - error payloads have no organic_results
+                if self.cache is not None and response.status == 200 and "organic_results" in data:
+                    self.cache.set(cache_key, results)
+                return {
+                    "query": query,
+                    "results": results
                 }
-                async with session.get("https://serpapi.com/search", params=params) as response:
-                    data = await response.json()
-                    results = data.get("organic_results", [])
-                    self._log_action("search_execution", {
-                        "query": query,
-                        "results_count": len(results)
-                    })
-                    return {
-                        "query": query,
-                        "results": results
-                    }
         except Exception as e:
             print(f"Search failed for query '{query}': {str(e)}")
             return {
@@ -93,24 +174,77 @@ class SimpleSearchOrchestrator:
                 "error": f"Search failed: {str(e)}"
             }
 
-    async def aggregate_results(self, search_results: List[Dict], topic: str) -> Dict:
-        """Aggregate and synthesize search results"""
-        # Format results for the model
-        formatted_results = []
+    def _pack_results(self, search_results: List[Dict]) -> List[Dict]:
+        """Deduplicate, rank and trim search hits to fit the context token budget"""
+        candidates = []
+        by_url = {}
+        total_hits = 0
         for result in search_results:
-            if "error" not in result:
-                for r in result["results"]:
-                    formatted_results.append({
+            if "error" in result:
+                continue
+            for position, r in enumerate(result["results"]):
+                total_hits += 1
+                url = r.get("link", "No link")
+                key = _normalize_url(url)
+                if key in by_url:
+                    # Same page from another query - count it as extra support instead of repeating it
+                    by_url[key]["hits"] += 1
+                    continue
+                snippet = r.get("snippet", "No snippet")
+                candidate = {
+                    "hits": 1,
+                    "position": position,
+                    "shingles": _shingles(snippet),
+                    "item": {
                         "query": result["query"],
                         "title": r.get("title", "No title"),
-                        "snippet": r.get("snippet", "No snippet"),
-                        "url": r.get("link", "No link")
-                    })
+                        "snippet": snippet,
+                        "url": url
+                    }
+                }
+                by_url[key] = candidate
+                candidates.append(candidate)
+
+        # Drop near-duplicate snippets (syndicated articles, mirrors), crediting the first copy
+        unique = []
+        for candidate in candidates:
+            for kept in unique:
+                overlap = len(candidate["shingles"] & kept["shingles"]) / len(candidate["shingles"] | kept["shingles"])
+                if overlap >= self.near_duplicate_threshold:
+                    kept["hits"] += candidate["hits"]
+                    break
+            else:
+                unique.append(candidate)
+
+        # Pages returned by several queries first, then by search rank
+        unique.sort(key=lambda c: (-c["hits"], c["position"]))
+
+        packed = []
+        used_tokens = 0
+        for candidate in unique:
+            tokens = _estimate_tokens(json.dumps(candidate["item"], separators=(",", ":"), ensure_ascii=False))
+            if packed and used_tokens + tokens > self.context_token_budget:
+                break
+            packed.append(candidate["item"])
+            used_tokens += tokens
+
+        self._log_action("context_packing", {
+            "total_hits": total_hits,
+            "unique_hits": len(unique),
+            "packed_hits": len(packed),
+            "estimated_tokens": used_tokens
+        })
+        return packed
+
+    async def aggregate_results(self, search_results: List[Dict], topic: str) -> Dict:
+        """Aggregate and synthesize search results"""
+        # Format results for the model - deduplicated, ranked and compact
+        formatted_results = self._pack_results(search_results)
 
         prompt = f"""Analyze and synthesize these search results about: "{topic}"
 
 Search Results:
-{json.dumps(formatted_results, indent=2)}
+{json.dumps(formatted_results, separators=(",", ":"), ensure_ascii=False)}
 
 Create a comprehensive summary that includes:
 1. Key findings and breakthroughs
@@ -125,26 +259,19 @@ Return ONLY a JSON object in this format:
     "sources": [<list of most relevant source URLs>]
 }}"""
 
-        response = self.model.generate_content(prompt)
+        response = await self.client.generate(self.model, prompt)
         try:
-            # Extract JSON from response
-            response_text = response.text.strip()
-            if response_text.startswith('```json'):
-                response_text = response_text[7:-3]
-            elif response_text.startswith('```'):
-                response_text = response_text[3:-3]
-            
-            synthesis = json.loads(response_text)
+            synthesis = parse_json(response.text, Synthesis, label="search_synthesis")
             self._log_action("result_synthesis", {
                 "topic": topic,
                 "synthesis": synthesis
             })
             return synthesis
-        except json.JSONDecodeError:
-            print(f"Failed to parse synthesis. Response: {response_text}")
+        except ModelOutputError:
+            print(f"Failed to parse synthesis. Response: {response.text}")
             return {
                 "error": "Failed to synthesize results",
-                "raw_response": response_text
+                "raw_response": response.text
             }
 
     async def research_topic(self, topic: str) -> Dict:
@@ -168,18 +295,108 @@ Return ONLY a JSON object in this format:
             "timestamp": datetime.now().isoformat()
         }
 
+    @staticmethod
+    async def _run_stage(inbox: asyncio.Queue, outbox: asyncio.Queue,
+                         work: Callable[[Dict], Awaitable[None]], workers: int):
+        """Run `workers` consumers of inbox, forwarding processed items to outbox"""
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is _DONE:
+                    # Hand the sentinel on so sibling workers stop too
+                    await inbox.put(_DONE)
+                    return
+                if "error" not in item:
+                    try:
+                        await work(item)
+                    except Exception as e:
+                        print(f"Research failed for topic '{item['topic']}': {str(e)}")
+                        item["error"] = str(e)
+                await outbox.put(item)
+
+        await asyncio.gather(*[worker() for _ in range(workers)])
+        await outbox.put(_DONE)
+
+    async def research_topics(self,
+                              topics: Iterable[str],
+                              query_workers: int = 2,
+                              search_workers: int = 4,
+                              synthesis_workers: int = 2,
+                              queue_size: int = 4) -> AsyncIterator[Dict]:
+        """Research many topics with the three stages overlapping across topics
+
+        Each stage has its own worker count and the stages are joined by bounded queues, so
+        a slow stage applies backpressure upstream. Results are yielded as each synthesis
+        finishes, in completion order.
+        """
+        topic_queue = asyncio.Queue(queue_size)
+        search_queue = asyncio.Queue(queue_size)
+        synthesis_queue = asyncio.Queue(queue_size)
+        done_queue = asyncio.Queue(queue_size)
+
+        async def feed():
+            for topic in topics:
+                await topic_queue.put({"topic": topic})
+            await topic_queue.put(_DONE)
+
+        async def generate(item: Dict):
+            item["queries"] = await self.generate_queries(item["topic"])
+
+        async def search(item: Dict):
+            item["raw_results"] = await asyncio.gather(*[
+                self.search_google(query) for query in item["queries"]
+            ])
+
+        async def synthesize(item: Dict):
+            item["synthesis"] = await self.aggregate_results(item["raw_results"], item["topic"])
+            item["timestamp"] = datetime.now().isoformat()
+
+        pipeline = asyncio.ensure_future(asyncio.gather(
+            feed(),
+            self._run_stage(topic_queue, search_queue, generate, query_workers),
+            self._run_stage(search_queue, synthesis_queue, search, search_workers),
+            self._run_stage(synthesis_queue, done_queue, synthesize, synthesis_workers)
+        ))
+        getter = None
+        try:
+            while True:
+                if pipeline.done():
+                    # Nothing more can arrive - surface a failure instead of waiting on the queue
+                    pipeline.result()
+                    item = done_queue.get_nowait()
+                else:
+                    # Wait on the pipeline too: if a stage or the topics iterable raises, no
+                    # sentinel is ever queued and done_queue.get() alone would block forever
+                    getter = asyncio.ensure_future(done_queue.get())
+                    await asyncio.wait({getter, pipeline}, return_when=asyncio.FIRST_COMPLETED)
+                    if not getter.done():
+                        getter.cancel()
+                        continue
+                    item = getter.result()
+                if item is _DONE:
+                    break
+                yield item
+            await pipeline
+        finally:
+            if getter is not None:
+                getter.cancel()
+            pipeline.cancel()
+            # Retrieve the outcome so a cancelled or failed pipeline isn't logged as unhandled
+            await asyncio.gather(pipeline, return_exceptions=True)
+
 # Example usage
 async def main():
     try:
-        orchestrator = SimpleSearchOrchestrator()
-        
         # Example research topic
         topic = "Latest advancements in quantum computing"
         
         print(f"🔍 Researching: {topic}")
         print("\nGenerating queries and searching...")
         
-        result = await orchestrator.research_topic(topic)
+        cache = SQLiteCache("search_cache.db", ttl=24 * 3600, max_entries=5000)
+        async with SimpleSearchOrchestrator(cache=cache) as orchestrator:
+            result = await orchestrator.research_topic(topic)
+        print(f"Search cache: {cache.stats()}")
         
         # Print synthesized results
         print("\n=== Research Summary ===")
@@ -1,37 +1,58 @@
 import google.generativeai as genai
-from typing import Dict, List
-import json
+from typing import AsyncIterator, Dict, Iterable, List, Tuple, Union
+from typing_extensions import NotRequired, TypedDict
 from datetime import datetime
 from dotenv import load_dotenv
 import os
 import asyncio
+import sys
+
+from batching import JsonlWriter, RateLimiter, bounded_as_completed, iter_records
+from json_extract import ModelOutputError, parse_json
+from llm_client import LLMClient, configure_gemini, get_client
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
+class Vote(TypedDict):
+    recommendation: str
+    confidence: float
+    reasoning: List[str]
+    # Optional - a vote that leaves these out still counts
+    risks: NotRequired[List[str]]
+    benefits: NotRequired[List[str]]
+
 class SurgeryVotingSystem:
-    def __init__(self, api_key: str = GEMINI_API_KEY):
-        genai.configure(api_key=api_key)
+    def __init__(self, api_key: str = None, max_concurrency: int = 3, models: List = None,
+                 rate_limits: List[float] = None, quorum: bool = False, client: LLMClient = None):
+        # genai has one global configuration, so api_key sets the key for the whole process
+        if api_key:
+            configure_gemini(api_key)
+        self.client = client or get_client()
+        # Stop waiting for votes once the outcome can no longer change
+        self.quorum = quorum
+        # Limit how many votes are in flight at once across all patients
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.models = models if models is not None else self._default_models(self.client)
+        # Optional requests/second cap for each model, matched to self.models by position
+        self._rate_limiters = {
+            id(model): RateLimiter(rate)
+            for model, rate in zip(self.models, rate_limits or [])
+            if rate
+        }
+
+    @staticmethod
+    def _default_models(client: LLMClient) -> List[genai.GenerativeModel]:
         # Create models with different temperature settings for more diverse opinions
-        self.models = [
-            genai.GenerativeModel('gemini-1.5-pro', generation_config=genai.types.GenerationConfig(
-                temperature=0.7,
-                candidate_count=1,
-                top_p=0.9,
-                top_k=40
-            )),
-            genai.GenerativeModel('gemini-1.5-pro', generation_config=genai.types.GenerationConfig(
-                temperature=0.8,
-                candidate_count=1,
-                top_p=0.9,
-                top_k=40
-            )),
-            genai.GenerativeModel('gemini-1.5-pro', generation_config=genai.types.GenerationConfig(
-                temperature=0.9,
-                candidate_count=1,
-                top_p=0.9,
-                top_k=40
-            ))
+        return [
+            client.gemini_model('gemini-1.5-pro', generation_config={
+                "temperature": temperature,
+                "candidate_count": 1,
+                "top_p": 0.9,
+                "top_k": 40
+            })
+            for temperature in (0.7, 0.8, 0.9)
         ]
 
     async def get_vote(self, model: genai.GenerativeModel, patient_data: Dict) -> Dict:
@@ -77,23 +98,21 @@ class SurgeryVotingSystem:
             ]
         }}"""
         
-        response = model.generate_content(prompt)
+        # Non-blocking call so votes from different models actually overlap
+        limiter = self._rate_limiters.get(id(model))
+        if limiter:
+            await limiter.acquire()
+        async with self._semaphore:
+            response = await self.client.generate(model, prompt)
         try:
-            # Extract JSON from response if there's additional text
-            text = response.text
-            start = text.find('{')
-            end = text.rfind('}') + 1
-            if start != -1 and end != 0:
-                json_str = text[start:end]
-                result = json.loads(json_str)
-                # Validate recommendation value
-                if result['recommendation'] not in ['surgery', 'no_surgery']:
-                    result['recommendation'] = 'no_surgery'  # default to conservative approach
-                return result
-            raise json.JSONDecodeError("No JSON found", text, 0)
-        except (json.JSONDecodeError, ValueError) as e:
+            result = parse_json(response.text, Vote, label="surgery_vote")
+            # Validate recommendation value
+            if result['recommendation'] not in ['surgery', 'no_surgery']:
+                result['recommendation'] = 'no_surgery'  # default to conservative approach
+            return result
+        except ModelOutputError as e:
             print(f"Error parsing response: {str(e)}")
-            print(f"Raw response: {text}")
+            print(f"Raw response: {response.text}")
             return {
                 "recommendation": "no_surgery",  # default to conservative approach
                 "confidence": 0.5,
@@ -102,7 +121,38 @@ class SurgeryVotingSystem:
                 "benefits": []
             }
 
-    async def aggregate_votes(self, votes: List[Dict]) -> Dict:
+    @staticmethod
+    def _is_decided(surgery_votes: int, no_surgery_votes: int, remaining: int) -> bool:
+        """True when the outstanding votes can no longer change final_recommendation"""
+        # Ties resolve to no_surgery, so surgery needs a strict majority
+        return surgery_votes > no_surgery_votes + remaining or surgery_votes + remaining <= no_surgery_votes
+
+    async def _collect_votes_with_quorum(self, patient_data: Dict) -> Tuple[List[Dict], List[int]]:
+        """Collect votes until the outcome is decided, cancelling the rest"""
+        tasks = {
+            asyncio.ensure_future(self.get_vote(model, patient_data)): i
+            for i, model in enumerate(self.models)
+        }
+        votes = {}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    votes[tasks[task]] = task.result()
+                surgery_votes = sum(1 for v in votes.values() if v['recommendation'] == 'surgery')
+                if self._is_decided(surgery_votes, len(votes) - surgery_votes, len(pending)):
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        skipped = sorted(tasks[task] for task in pending)
+        return [votes[i] for i in sorted(votes)], skipped
+
+    async def aggregate_votes(self, votes: List[Dict], skipped_votes: List[int] = None) -> Dict:
         """Aggregate multiple votes into a final decision"""
         # Count recommendations
         surgery_votes = sum(1 for v in votes if v['recommendation'] == 'surgery')
@@ -134,27 +184,38 @@ class SurgeryVotingSystem:
             "consolidated_reasoning": list(all_reasoning),
             "consolidated_risks": list(all_risks),
             "consolidated_benefits": list(all_benefits),
-            "unanimous": surgery_votes == len(votes) or no_surgery_votes == len(votes)
+            "unanimous": surgery_votes == len(votes) or no_surgery_votes == len(votes),
+            # Indexes into self.models of votes cancelled by quorum mode
+            "skipped_votes": skipped_votes or []
         }
 
-    async def get_surgery_recommendation(self, patient_data: Dict) -> Dict:
+    async def get_surgery_recommendation(self, patient_data: Dict, verbose: bool = True,
+                                         quorum: bool = None) -> Dict:
         """Get parallel votes and aggregate them"""
-        # Get votes in parallel
-        votes = await asyncio.gather(*[
-            self.get_vote(model, patient_data)
-            for model in self.models
-        ])
+        if quorum is None:
+            quorum = self.quorum
+        if quorum:
+            votes, skipped_votes = await self._collect_votes_with_quorum(patient_data)
+        else:
+            # Get votes in parallel
+            votes = await asyncio.gather(*[
+                self.get_vote(model, patient_data)
+                for model in self.models
+            ])
+            skipped_votes = []
         
         # Print individual votes for debugging
-        print("\nIndividual Model Votes:")
-        for i, vote in enumerate(votes, 1):
-            print(f"\nModel {i} Vote:")
-            print(f"Recommendation: {vote['recommendation']}")
-            print(f"Confidence: {vote['confidence']}")
-            print(f"Reasoning: {vote['reasoning']}")
+        if verbose:
+            print("\nIndividual Model Votes:")
+            model_numbers = [i for i in range(1, len(self.models) + 1) if i - 1 not in skipped_votes]
+            for i, vote in zip(model_numbers, votes):
+                print(f"\nModel {i} Vote:")
+                print(f"Recommendation: {vote['recommendation']}")
+                print(f"Confidence: {vote['confidence']}")
+                print(f"Reasoning: {vote['reasoning']}")
         
         # Aggregate results
-        final_decision = await self.aggregate_votes(votes)
+        final_decision = await self.aggregate_votes(votes, skipped_votes)
         
         return {
             "individual_votes": votes,
@@ -162,6 +223,40 @@ class SurgeryVotingSystem:
             "timestamp": datetime.now().isoformat()
         }
 
+    async def evaluate_patients(self,
+                                patients: Union[str, Iterable[Dict]],
+                                output_path: str = None,
+                                max_patients_in_flight: int = None) -> AsyncIterator[Dict]:
+        """Stream aggregated decisions for many patients, in completion order
+
+        `patients` is a JSONL path or any iterable of patient dicts. Records are read lazily
+        and each result is written to `output_path` (JSONL) as soon as it finishes.
+        """
+        # Enough patients in flight to keep every vote slot busy, but no more
+        if max_patients_in_flight is None:
+            max_patients_in_flight = max(1, -(-self.max_concurrency // len(self.models)) * 2)
+
+        async def evaluate(indexed):
+            index, patient_data = indexed
+            try:
+                result = await self.get_surgery_recommendation(patient_data, verbose=False)
+            except Exception as e:
+                print(f"Evaluation failed for patient {index}: {str(e)}")
+                result = {"error": str(e), "timestamp": datetime.now().isoformat()}
+            return {"index": index, "patient_id": patient_data.get("id", index), **result}
+
+        writer = JsonlWriter(output_path) if output_path else None
+        try:
+            async for result in bounded_as_completed(
+                enumerate(iter_records(patients)), evaluate, max_patients_in_flight
+            ):
+                if writer:
+                    writer.write(result)
+                yield result
+        finally:
+            if writer:
+                writer.close()
+
 # Example usage
 async def main():
     patient_data = {
@@ -196,6 +291,21 @@ async def main():
     
     if not result['aggregated_decision']['unanimous']:
         print("\nNote: Decision was not unanimous among models")
+    if result['aggregated_decision']['skipped_votes']:
+        print(f"Skipped votes (quorum reached): {result['aggregated_decision']['skipped_votes']}")
+
+async def batch_main(input_path: str, output_path: str):
+    voting_system = SurgeryVotingSystem(max_concurrency=12)
+    completed = 0
+    async for result in voting_system.evaluate_patients(input_path, output_path):
+        completed += 1
+        decision = result.get("aggregated_decision", {}).get("final_recommendation", "error")
+        print(f"[{completed}] patient {result['patient_id']}: {decision}")
+    print(f"\nWrote {completed} decisions to {output_path}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # python parallelization.py patients.jsonl decisions.jsonl
+    if len(sys.argv) == 3:
+        asyncio.run(batch_main(sys.argv[1], sys.argv[2]))
+    else:
+        asyncio.run(main())
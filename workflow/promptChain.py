@@ -1,6 +1,9 @@
-import google.generativeai as genai
-from typing import Dict, List
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, TypedDict, Union
 import json
+import asyncio
+import contextlib
+import itertools
+import sys
 from datetime import datetime
 from dotenv import load_dotenv
 import os
@@ -8,6 +11,15 @@ from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
 from rich import box
+from rich.progress import BarColumn, MofNCompleteColumn, Progress, TextColumn, TimeElapsedColumn
+
+from batching import JsonlWriter, bounded_as_completed, iter_records
+from cache import MemoryCache, SQLiteCache, StepCache
+from history import HistorySink
+from json_extract import ModelOutputError, parse_json
+from llm_client import LLMClient, configure_gemini, get_client
+from nutrition import calculate_requirements, calculate_requirements_batch, free_text_entries
+from shopping import CATEGORIES, build_shopping_list, unknown_ingredients
 
 load_dotenv()
 
@@ -117,7 +129,9 @@ def format_shopping_list(shopping_list: Dict) -> None:
     """Format and display shopping list"""
     console.print("\n[bold cyan]🛒 Shopping List[/bold cyan]", style="bold")
     
+    # Locally built lists have no prices, so totals only cover items that came with one
     total_cost = 0
+    priced = False
     for category in shopping_list['shopping_list']:
         console.print(f"\n[bold magenta]📦 {category['category']}[/bold magenta]")
         
@@ -128,38 +142,139 @@ def format_shopping_list(shopping_list: Dict) -> None:
         table.add_column("Alternatives", style="magenta")
         
         category_cost = 0
+        category_priced = False
         for item in category['items']:
-            cost = item['estimated_cost']
-            category_cost += cost
+            cost = item.get('estimated_cost')
+            if cost is not None:
+                category_cost += cost
+                category_priced = True
             table.add_row(
                 item['name'],
                 str(item['quantity']),
-                f"${cost:.2f}",
+                f"${cost:.2f}" if cost is not None else "—",
                 ", ".join(item.get('alternatives', []) or ["—"])
             )
         
-        total_cost += category_cost
-        table.add_section()
-        table.add_row(
-            "[bold]Category Total[/bold]",
-            "",
-            f"[bold]${category_cost:.2f}[/bold]",
-            ""
-        )
+        if category_priced:
+            total_cost += category_cost
+            priced = True
+            table.add_section()
+            table.add_row(
+                "[bold]Category Total[/bold]",
+                "",
+                f"[bold]${category_cost:.2f}[/bold]",
+                ""
+            )
         
         console.print(table)
     
-    console.print(Panel(
-        f"[bold green]Total Estimated Cost: ${total_cost:.2f}[/bold green]",
-        border_style="cyan",
-        box=box.HEAVY_EDGE
-    ))
+    if priced:
+        console.print(Panel(
+            f"[bold green]Total Estimated Cost: ${total_cost:.2f}[/bold green]",
+            border_style="cyan",
+            box=box.HEAVY_EDGE
+        ))
+
+# Response schemas - replies that don't match fall back to the step's default
+class MacroSplit(TypedDict):
+    protein: float
+    carbs: float
+    fats: float
+
+class Requirements(TypedDict):
+    daily_calories: float
+    macronutrient_split: MacroSplit
+    micronutrient_focus: List[str]
+    meal_frequency: int
+    dietary_considerations: List[str]
+
+class Meal(TypedDict):
+    meal_name: str
+    timing: str
+    calorie_allocation: float
+    macro_allocation: MacroSplit
+
+class MealStructure(TypedDict):
+    meals: List[Meal]
+
+class _MealOptionRequired(TypedDict):
+    name: str
+    ingredients: List[str]
+
+class MealOption(_MealOptionRequired, total=False):
+    preparation_time: str
+    cooking_instructions: List[str]
+    macronutrients: Dict[str, float]
+    calories: float
+
+class _MealPeriodRequired(TypedDict):
+    options: List[MealOption]
+
+class MealPeriod(_MealPeriodRequired, total=False):
+    meal_name: str
+
+class MealOptions(TypedDict):
+    meal_options: List[MealPeriod]
+
+class _ShoppingItemRequired(TypedDict):
+    name: str
+    quantity: Union[str, float]
+
+class ShoppingItem(_ShoppingItemRequired, total=False):
+    estimated_cost: float
+    alternatives: List[str]
+
+class ShoppingCategory(TypedDict):
+    category: str
+    items: List[ShoppingItem]
+
+class ShoppingList(TypedDict):
+    shopping_list: List[ShoppingCategory]
+
+# Bump a step's version whenever its prompt or parsing changes, so cached outputs are not reused
+PROMPT_VERSIONS = {
+    "requirements_analysis": 2,
+    "dietary_considerations": 2,
+    "meal_structure": 2,
+    "meal_options": 2,
+    "meal_period_options": 2,
+    "shopping_list": 2,
+    "ingredient_categories": 2
+}
+
+# user_input fields that affect step 1 - anything else (ids, names) must not split the cache
+REQUIREMENT_FIELDS = ("age", "weight", "height", "sex", "gender", "activity_level",
+                      "restrictions", "goals", "health_conditions")
+
+def _slot(step_semaphores: Optional[Dict[str, asyncio.Semaphore]], step: str):
+    """The shared semaphore limiting this step, or a no-op when there is none"""
+    semaphore = (step_semaphores or {}).get(step)
+    return semaphore if semaphore is not None else contextlib.nullcontext()
 
 class MealPlanChain:
-    def __init__(self, api_key: str = GEMINI_API_KEY, model: str = "gemini-1.5-flash"):
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(model)
-        self.history = []
+    def __init__(self, api_key: str = None, model: str = "gemini-1.5-flash", client: LLMClient = None,
+                 cache: StepCache = None, history: HistorySink = None):
+        # genai has one global configuration, so api_key sets the key for the whole process
+        if api_key:
+            configure_gemini(api_key)
+        self.client = client or get_client()
+        self.model_name = model
+        self.model = self.client.gemini_model(model)
+        self.cache = cache
+        # Bounded so long-lived workers don't grow without limit; pass a sink to hash or spill
+        self.history = history if history is not None else HistorySink()
+
+    async def _cached_step(self, step: str, inputs, compute) -> Dict:
+        """Run compute() through the step cache when one is configured
+
+        compute returns (result, cacheable); fallback results are not cacheable so a bad
+        response is retried next time instead of being served from the cache.
+        """
+        if self.cache is None:
+            result, _ = await compute()
+            return result
+        key = self.cache.key(step, inputs, self.model_name, PROMPT_VERSIONS[step])
+        return await self.cache.get_or_compute(key, compute)
 
     def _log_step(self, step_name: str, prompt: str, response: str):
         """Log each step of the chain for tracking"""
@@ -170,8 +285,53 @@ class MealPlanChain:
             "response": response
         })
 
-    async def analyze_requirements(self, user_input: Dict) -> Dict:
-        """Step 1: Analyze user requirements and calculate nutritional needs"""
+    async def analyze_requirements(self, user_input: Dict, local: bool = True,
+                                   calculated: Dict = None) -> Dict:
+        """Step 1: Analyze user requirements and calculate nutritional needs
+
+        Numbers come from the local calculator in nutrition.py (or `calculated`, when a batch
+        already computed them); the model is only asked about free-text restrictions and
+        health conditions. Falls back to the full LLM analysis when local is False or the
+        user's measurements can't be parsed.
+        """
+        if not local:
+            return await self._analyze_requirements_llm(user_input)
+        result = calculated
+        if result is None:
+            try:
+                result = calculate_requirements(user_input)
+            except (KeyError, ValueError):
+                return await self._analyze_requirements_llm(user_input)
+
+        free_text = free_text_entries(user_input)
+        if free_text:
+            result["dietary_considerations"] += await self._dietary_considerations(free_text)
+        self._log_step("requirements_analysis", "local calculation", result)
+        return result
+
+    async def _dietary_considerations(self, entries: List[str]) -> List[str]:
+        """Turn free-text restrictions and health conditions into short dietary considerations"""
+        prompt = f"""
+        Turn these dietary restrictions and health conditions into short, practical dietary considerations
+        for a meal plan:
+        {json.dumps(entries)}
+
+        Return ONLY a JSON array of strings, e.g. ["Avoid highly processed foods"].
+        """
+
+        async def compute():
+            response = await self.client.generate(self.model, prompt)
+            try:
+                return parse_json(response.text, List[str], label="dietary_considerations"), True
+            except ModelOutputError:
+                return entries, False
+
+        considerations = await self._cached_step("dietary_considerations", entries, compute)
+        self._log_step("dietary_considerations", prompt, considerations)
+        return considerations
+
+    async def _analyze_requirements_llm(self, user_input: Dict) -> Dict:
+        """Step 1 done entirely by the model"""
         prompt = """
         Based on these user details, calculate daily nutritional requirements:
         - Age: {age}
@@ -197,24 +357,22 @@ class MealPlanChain:
 
         Follow this exact format but replace the values appropriately.
         """.format(**user_input)
-        
-        response = self.model.generate_content(prompt)
-        try:
-            result = json.loads(response.text)
-        except json.JSONDecodeError:
-            text = response.text
+
+        async def compute():
+            response = await self.client.generate(self.model, prompt)
             try:
-                json_str = text[text.find('{'):text.rfind('}')+1]
-                result = json.loads(json_str)
-            except (json.JSONDecodeError, ValueError):
-                result = {
+                return parse_json(response.text, Requirements, label="requirements_analysis"), True
+            except ModelOutputError:
+                return {
                     "daily_calories": 2000,
                     "macronutrient_split": {"protein": 150, "carbs": 200, "fats": 67},
                     "micronutrient_focus": ["Vitamin D", "Iron"],
                     "meal_frequency": 3,
                     "dietary_considerations": user_input.get('restrictions', [])
-                }
-        
+                }, False
+
+        inputs = {field: user_input.get(field) for field in REQUIREMENT_FIELDS}
+        result = await self._cached_step("requirements_analysis", inputs, compute)
         self._log_step("requirements_analysis", prompt, result)
         return result
 
@@ -246,16 +404,12 @@ class MealPlanChain:
         Follow this format but adjust values and add more meals as needed.
         """.format(**requirements)
 
-        response = self.model.generate_content(prompt)
-        try:
-            result = json.loads(response.text)
-        except json.JSONDecodeError:
-            text = response.text
+        async def compute():
+            response = await self.client.generate(self.model, prompt)
             try:
-                json_str = text[text.find('{'):text.rfind('}')+1]
-                result = json.loads(json_str)
-            except (json.JSONDecodeError, ValueError):
-                result = {
+                return parse_json(response.text, MealStructure, label="meal_structure"), True
+            except ModelOutputError:
+                return {
                     "meals": [
                         {
                             "meal_name": "Default Meal",
@@ -264,8 +418,9 @@ class MealPlanChain:
                             "macro_allocation": requirements['macronutrient_split']
                         }
                     ]
-                }
-        
+                }, False
+
+        result = await self._cached_step("meal_structure", requirements, compute)
         self._log_step("meal_structure", prompt, result)
         return result
 
@@ -307,40 +462,194 @@ class MealPlanChain:
         Create 2-3 options for each meal period in the meal structure, ensuring they match the calorie and macro requirements.
         """
 
-        response = self.model.generate_content(prompt)
-        try:
-            result = json.loads(response.text)
-        except json.JSONDecodeError:
-            text = response.text
+        async def compute():
+            response = await self.client.generate(self.model, prompt)
             try:
-                json_str = text[text.find('{'):text.rfind('}')+1]
-                result = json.loads(json_str)
-            except (json.JSONDecodeError, ValueError):
+                return parse_json(response.text, MealOptions, label="meal_options"), True
+            except ModelOutputError:
                 # Create a default meal option for each meal in the structure
-                result = {
+                return {
                     "meal_options": [
-                        {
-                            "meal_name": meal["meal_name"],
-                            "options": [
-                                {
-                                    "name": f"Default {meal['meal_name']} Option",
-                                    "ingredients": ["protein source", "vegetables", "grains"],
-                                    "preparation_time": "30 minutes",
-                                    "cooking_instructions": ["Prepare ingredients", "Cook according to preferences", "Serve hot"],
-                                    "macronutrients": meal["macro_allocation"],
-                                    "calories": meal["calorie_allocation"]
-                                }
-                            ]
-                        }
+                        self._default_meal_period(meal)
                         for meal in structure["meals"]
                     ]
-                }
-        
+                }, False
+
+        inputs = {"meals": structure["meals"], "restrictions": restrictions}
+        result = await self._cached_step("meal_options", inputs, compute)
         self._log_step("meal_options", prompt, result)
         return result
 
-    async def create_shopping_list(self, meal_plan: Dict) -> Dict:
-        """Step 4: Generate shopping list"""
+    @staticmethod
+    def _default_meal_period(meal: Dict) -> Dict:
+        """Fallback options for one meal when the model response can't be parsed"""
+        return {
+            "meal_name": meal["meal_name"],
+            "options": [
+                {
+                    "name": f"Default {meal['meal_name']} Option",
+                    "ingredients": ["protein source", "vegetables", "grains"],
+                    "preparation_time": "30 minutes",
+                    "cooking_instructions": ["Prepare ingredients", "Cook according to preferences", "Serve hot"],
+                    "macronutrients": meal["macro_allocation"],
+                    "calories": meal["calorie_allocation"]
+                }
+            ]
+        }
+
+    async def generate_single_meal_options(self, meal: Dict, restrictions: List[str]) -> Dict:
+        """Step 3 for one meal: generate options for a single entry of structure["meals"]"""
+        meal_str = json.dumps(meal)
+        restrictions_str = json.dumps(restrictions)
+
+        prompt = f"""
+        Generate meal options for this meal period considering:
+        Meal: {meal_str}
+        Dietary Restrictions: {restrictions_str}
+
+        Return a JSON object in this exact format:
+        {{
+            "meal_name": "{meal['meal_name']}",
+            "options": [
+                {{
+                    "name": "Oatmeal Bowl",
+                    "ingredients": ["oats", "banana", "honey"],
+                    "preparation_time": "15 minutes",
+                    "cooking_instructions": ["Boil water", "Add oats", "Top with fruits"],
+                    "macronutrients": {{
+                        "protein": 15,
+                        "carbs": 45,
+                        "fats": 8
+                    }},
+                    "calories": 350
+                }}
+            ]
+        }}
+
+        Create 2-3 options, ensuring they match the meal's calorie and macro requirements.
+        """
+
+        async def compute():
+            response = await self.client.generate(self.model, prompt)
+            try:
+                result = parse_json(response.text, MealPeriod, label="meal_period_options")
+            except ModelOutputError:
+                # Only this meal falls back - the others keep their generated options
+                return self._default_meal_period(meal), False
+            # Keep the name from the structure so results line up with the requested meals
+            result["meal_name"] = meal["meal_name"]
+            return result, True
+
+        inputs = {"meal": meal, "restrictions": restrictions}
+        result = await self._cached_step("meal_period_options", inputs, compute)
+
+        self._log_step(f"meal_options:{meal['meal_name']}", prompt, result)
+        return result
+
+    async def generate_options_and_shopping_list(self,
+                                                 structure: Dict,
+                                                 restrictions: List[str],
+                                                 local: bool = True,
+                                                 step_semaphores: Dict[str, asyncio.Semaphore] = None
+                                                 ) -> Tuple[Dict, Dict]:
+        """Steps 3 and 4 fanned out per meal
+
+        Options for every meal are generated concurrently. With the local shopping list the
+        list is built once all options are in; otherwise a partial list is requested from
+        the model for each meal as soon as its options arrive, and the partial lists are
+        merged at the end so step 4 overlaps with the slowest meals of step 3.
+        step_semaphores are as in run: the "options" slot is held until every meal's options
+        are in, and each shopping-list call takes a "shopping_list" slot.
+        """
+        async def partial_shopping_list(meal_period: Dict) -> Dict:
+            async with _slot(step_semaphores, "shopping_list"):
+                return await self.create_shopping_list({"meal_options": [meal_period]}, local=False)
+
+        shopping_tasks = []
+        async with _slot(step_semaphores, "options"):
+            option_tasks = [
+                asyncio.ensure_future(self.generate_single_meal_options(meal, restrictions))
+                for meal in structure["meals"]
+            ]
+            if not local:
+                for finished in asyncio.as_completed(option_tasks):
+                    meal_period = await finished
+                    shopping_tasks.append(asyncio.ensure_future(partial_shopping_list(meal_period)))
+            # Results of gather keep structure order
+            meal_options = {"meal_options": list(await asyncio.gather(*option_tasks))}
+
+        if local:
+            async with _slot(step_semaphores, "shopping_list"):
+                return meal_options, await self.create_shopping_list(meal_options)
+        shopping_list = self._merge_shopping_lists(await asyncio.gather(*shopping_tasks))
+        return meal_options, shopping_list
+
+    @staticmethod
+    def _merge_shopping_lists(shopping_lists: List[Dict]) -> Dict:
+        """Merge per-meal shopping lists, combining categories and items that share a name"""
+        categories: Dict[str, Dict] = {}
+        for shopping_list in shopping_lists:
+            for category in shopping_list.get("shopping_list", []):
+                merged_category = categories.setdefault(
+                    category["category"].lower(),
+                    {"category": category["category"], "items": {}}
+                )
+                for item in category.get("items", []):
+                    existing = merged_category["items"].get(item["name"].lower())
+                    if existing is None:
+                        merged_category["items"][item["name"].lower()] = dict(item)
+                        continue
+                    existing["quantity"] = f"{existing['quantity']} + {item['quantity']}"
+                    existing["estimated_cost"] = existing.get("estimated_cost", 0) + item.get("estimated_cost", 0)
+                    existing["alternatives"] = list(dict.fromkeys(
+                        existing.get("alternatives", []) + item.get("alternatives", [])
+                    ))
+        return {
+            "shopping_list": [
+                {"category": c["category"], "items": list(c["items"].values())}
+                for c in categories.values()
+            ]
+        }
+
+    async def create_shopping_list(self, meal_plan: Dict, local: bool = True) -> Dict:
+        """Step 4: Generate shopping list
+
+        Ingredients are merged, converted and categorized locally by shopping.py; the model
+        is only asked to categorize ingredients the lookup table doesn't know. With local
+        False the whole list is built by the model.
+        """
+        if not local:
+            return await self._create_shopping_list_llm(meal_plan)
+        unknown = unknown_ingredients(meal_plan["meal_options"])
+        extra_categories = await self._categorize_ingredients(unknown) if unknown else {}
+        result = build_shopping_list(meal_plan["meal_options"], extra_categories)
+        self._log_step("shopping_list", "local consolidation", result)
+        return result
+
+    async def _categorize_ingredients(self, names: List[str]) -> Dict[str, str]:
+        """Ask the model to sort ingredients the lookup table doesn't recognize into categories"""
+        categories = list(CATEGORIES) + ["Other"]
+        prompt = f"""
+        Assign each grocery ingredient to one of these store categories: {json.dumps(categories)}
+        Ingredients: {json.dumps(names)}
+
+        Return ONLY a JSON object mapping each ingredient to its category, e.g. {{"dragonfruit": "Produce"}}.
+        """
+
+        async def compute():
+            response = await self.client.generate(self.model, prompt)
+            try:
+                mapping = parse_json(response.text, Dict[str, str], label="ingredient_categories")
+            except ModelOutputError:
+                return {}, False
+            return {name: category for name, category in mapping.items() if category in categories}, True
+
+        result = await self._cached_step("ingredient_categories", sorted(names), compute)
+        self._log_step("ingredient_categories", prompt, result)
+        return result
+
+    async def _create_shopping_list_llm(self, meal_plan: Dict) -> Dict:
+        """Step 4 done entirely by the model"""
         meal_options_str = json.dumps(meal_plan["meal_options"], indent=2)
         
         prompt = f"""
@@ -367,16 +676,12 @@ class MealPlanChain:
         Follow this format but create appropriate categories and items based on the meals.
         """
 
-        response = self.model.generate_content(prompt)
-        try:
-            result = json.loads(response.text)
-        except json.JSONDecodeError:
-            text = response.text
+        async def compute():
+            response = await self.client.generate(self.model, prompt)
             try:
-                json_str = text[text.find('{'):text.rfind('}')+1]
-                result = json.loads(json_str)
-            except (json.JSONDecodeError, ValueError):
-                result = {
+                return parse_json(response.text, ShoppingList, label="shopping_list"), True
+            except ModelOutputError:
+                return {
                     "shopping_list": [
                         {
                             "category": "Basic Ingredients",
@@ -390,13 +695,121 @@ class MealPlanChain:
                             ]
                         }
                     ]
-                }
-        
+                }, False
+
+        result = await self._cached_step("shopping_list", meal_plan["meal_options"], compute)
         self._log_step("shopping_list", prompt, result)
         return result
 
-async def generate_meal_plan(user_input: Dict):
-    """Main function to run the meal planning chain"""
+    async def run(self, user_input: Dict, fan_out: bool = False,
+                  step_semaphores: Dict[str, asyncio.Semaphore] = None,
+                  requirements: Dict = None) -> Dict:
+        """Run all four steps for one user without printing
+
+        step_semaphores optionally maps step names ("requirements", "structure", "options",
+        "shopping_list") to semaphores shared across chains, so a batch can cap how many
+        calls of each step are in flight. requirements, when given, are this user's locally
+        calculated numbers (see calculate_requirements_batch).
+        """
+        def slot(step: str):
+            return _slot(step_semaphores, step)
+
+        async with slot("requirements"):
+            requirements = await self.analyze_requirements(user_input, calculated=requirements)
+        async with slot("structure"):
+            structure = await self.create_meal_structure(requirements)
+        restrictions = user_input.get('restrictions', [])
+        if fan_out:
+            # Takes the "options" and "shopping_list" slots itself, as each part runs
+            meal_options, shopping_list = await self.generate_options_and_shopping_list(
+                structure, restrictions, step_semaphores=step_semaphores
+            )
+        else:
+            async with slot("options"):
+                meal_options = await self.generate_meal_options(structure, restrictions)
+            async with slot("shopping_list"):
+                shopping_list = await self.create_shopping_list(meal_options)
+
+        return {
+            "requirements": requirements,
+            "meal_structure": structure,
+            "meal_options": meal_options,
+            "shopping_list": shopping_list
+        }
+
+def _with_requirements(user_inputs: Union[str, Iterable[Dict]],
+                       batch_size: int) -> Iterator[Tuple[int, Dict, Optional[Dict]]]:
+    """(index, user_input, calculated requirements or None) for each record, read lazily
+
+    Records are pulled batch_size at a time and their requirements calculated together.
+    """
+    records = enumerate(iter_records(user_inputs))
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+        calculated = calculate_requirements_batch([user_input for _, user_input in batch])
+        for (index, user_input), requirements in zip(batch, calculated):
+            yield index, user_input, requirements
+
+async def generate_meal_plans(user_inputs: Union[str, Iterable[Dict]],
+                              output_path: str,
+                              max_users_in_flight: int = 32,
+                              step_concurrency: Dict[str, int] = None,
+                              fan_out: bool = False,
+                              total: int = None,
+                              client: LLMClient = None,
+                              cache: StepCache = None,
+                              history: HistorySink = None) -> AsyncIterator[Dict]:
+    """Generate meal plans for a cohort, streaming each finished plan to a JSONL file
+
+    `user_inputs` is a JSONL path or an iterable of user_input dicts, read lazily. Up to
+    max_users_in_flight chains run at once, and each step has its own limit in
+    step_concurrency, so users at different steps overlap. Step 1's numbers are calculated
+    for max_users_in_flight users at a time as records are read. The LLM client's provider
+    limit caps the total number of model calls on top of that. Chains share one step
+    cache (in memory unless given), so users with matching inputs reuse each other's outputs.
+    When a history sink is given, every chain logs its steps to it.
+    """
+    limits = {"requirements": 32, "structure": 16, "options": 16, "shopping_list": 16, **(step_concurrency or {})}
+    step_semaphores = {step: asyncio.Semaphore(limit) for step, limit in limits.items()}
+    client = client or get_client()
+    cache = cache or StepCache(MemoryCache(max_entries=4096))
+
+    async def plan(item):
+        index, user_input, requirements = item
+        chain = MealPlanChain(client=client, cache=cache, history=history)
+        try:
+            result = await chain.run(user_input, fan_out=fan_out, step_semaphores=step_semaphores,
+                                     requirements=requirements)
+        except Exception as e:
+            result = {"error": str(e)}
+        return {"index": index, "user_id": user_input.get("id", index), **result}
+
+    progress = Progress(
+        TextColumn("[bold cyan]Meal plans"),
+        BarColumn(),
+        MofNCompleteColumn(),
+        TimeElapsedColumn(),
+        TextColumn("[red]{task.fields[failed]} failed"),
+        console=console
+    )
+    with progress, JsonlWriter(output_path) as writer:
+        task = progress.add_task("plans", total=total, failed=0)
+        failed = 0
+        async for result in bounded_as_completed(_with_requirements(user_inputs, max_users_in_flight), plan,
+                                               max_users_in_flight):
+            writer.write(result)
+            failed += "error" in result
+            progress.update(task, advance=1, failed=failed)
+            yield result
+
+async def generate_meal_plan(user_input: Dict, fan_out: bool = False):
+    """Main function to run the meal planning chain
+
+    With fan_out, meal options are generated per meal concurrently and the shopping list
+    is built incrementally as each meal's options arrive.
+    """
     try:
         chain = MealPlanChain()
         
@@ -410,25 +823,36 @@ async def generate_meal_plan(user_input: Dict):
         print("✓ Meal structure created")
         format_meal_structure(structure)
 
-        # Step 3: Generate Meal Options
-        meal_options = await chain.generate_meal_options(
-            structure,
-            user_input.get('restrictions', [])
-        )
-        print("✓ Meal options generated")
-        format_meal_options(meal_options)
+        if fan_out:
+            # Steps 3 + 4: per-meal options with the shopping list built as they arrive
+            meal_options, shopping_list = await chain.generate_options_and_shopping_list(
+                structure,
+                user_input.get('restrictions', [])
+            )
+            print("✓ Meal options generated")
+            format_meal_options(meal_options)
+            print("✓ Shopping list created")
+            format_shopping_list(shopping_list)
+        else:
+            # Step 3: Generate Meal Options
+            meal_options = await chain.generate_meal_options(
+                structure,
+                user_input.get('restrictions', [])
+            )
+            print("✓ Meal options generated")
+            format_meal_options(meal_options)
 
-        # Step 4: Create Shopping List
-        shopping_list = await chain.create_shopping_list(meal_options)
-        print("✓ Shopping list created")
-        format_shopping_list(shopping_list)
+            # Step 4: Create Shopping List
+            shopping_list = await chain.create_shopping_list(meal_options)
+            print("✓ Shopping list created")
+            format_shopping_list(shopping_list)
 
         return {
             "requirements": requirements,
             "meal_structure": structure,
             "meal_options": meal_options,
             "shopping_list": shopping_list,
-            "chain_history": chain.history
+            "chain_history": list(chain.history)
         }
 
     except Exception as e:
@@ -448,10 +872,27 @@ user_input = {
 
 async def main():
     # Run the chain
-    meal_plan = await generate_meal_plan(user_input)
+    meal_plan = await generate_meal_plan(user_input, fan_out=True)
     return meal_plan
 
+async def batch_main(input_path: str, output_path: str):
+    # Disk-backed so reruns over the same cohort skip steps that already succeeded
+    cache = StepCache(SQLiteCache("meal_plan_cache.db", ttl=7 * 24 * 3600))
+    # Keep only hashes of recent prompts in memory; the full log goes to disk
+    history = HistorySink(hash_text=True, spill_path=output_path + ".history.jsonl.gz")
+    completed = 0
+    try:
+        async for _ in generate_meal_plans(input_path, output_path, fan_out=True, cache=cache, history=history):
+            completed += 1
+    finally:
+        history.close()
+    console.print(f"[bold green]Wrote {completed} meal plans to {output_path}[/bold green]")
+    console.print(f"Step cache: {cache.stats()}")
+
 if __name__ == "__main__":
-    import asyncio
-    meal_plan = asyncio.run(main())
-    #print(meal_plan)
\ No newline at end of file
+    # python promptChain.py users.jsonl meal_plans.jsonl
+    if len(sys.argv) == 3:
+        asyncio.run(batch_main(sys.argv[1], sys.argv[2]))
+    else:
+        meal_plan = asyncio.run(main())
+        #print(meal_plan)
\ No newline at end of file
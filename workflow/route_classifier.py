@@ -0,0 +1,127 @@
+# Local FLASH/PRO routing classifier - TF-IDF features + logistic regression, trained on logged router decisions
+# Pure Python so it runs in-process without extra dependencies
+#
+# Train:  python route_classifier.py router_decisions.jsonl route_classifier.json
+
+import json
+import math
+import random
+import sys
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+from cache import normalize_question
+
+def _features(question: str) -> List[str]:
+    words = normalize_question(question).split()
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+def _sigmoid(z: float) -> float:
+    if z < 0:
+        e = math.exp(z)
+        return e / (1 + e)
+    return 1 / (1 + math.exp(-z))
+
+class LocalRouteClassifier:
+    """Predicts whether a question needs the PRO model, with a confidence score"""
+
+    def __init__(self, vocabulary: Dict[str, int] = None, idf: List[float] = None,
+                 weights: List[float] = None, bias: float = 0.0):
+        self.vocabulary = vocabulary or {}
+        self.idf = idf or []
+        self.weights = weights or []
+        self.bias = bias
+
+    def _vectorize(self, question: str) -> Dict[int, float]:
+        """L2-normalized TF-IDF vector as a sparse dict"""
+        counts = Counter(self.vocabulary[f] for f in _features(question) if f in self.vocabulary)
+        vector = {i: tf * self.idf[i] for i, tf in counts.items()}
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+        return {i: v / norm for i, v in vector.items()}
+
+    def fit(self, questions: List[str], labels: List[str], min_df: int = 2,
+            epochs: int = 30, learning_rate: float = 0.5, l2: float = 1e-4) -> "LocalRouteClassifier":
+        """Train on questions labelled "FLASH" or "PRO" """
+        doc_freq = Counter(f for q in questions for f in set(_features(q)))
+        terms = sorted(f for f, df in doc_freq.items() if df >= min_df)
+        self.vocabulary = {f: i for i, f in enumerate(terms)}
+        n_docs = len(questions)
+        self.idf = [math.log((1 + n_docs) / (1 + doc_freq[f])) + 1 for f in terms]
+        self.weights = [0.0] * len(terms)
+        self.bias = 0.0
+
+        samples = [(self._vectorize(q), 1.0 if label == "PRO" else 0.0) for q, label in zip(questions, labels)]
+        rng = random.Random(0)
+        for epoch in range(epochs):
+            rng.shuffle(samples)
+            step = learning_rate / (1 + epoch * 0.1)
+            for vector, target in samples:
+                error = self._score(vector) - target
+                for i, v in vector.items():
+                    self.weights[i] -= step * (error * v + l2 * self.weights[i])
+                self.bias -= step * error
+        return self
+
+    def _score(self, vector: Dict[int, float]) -> float:
+        return _sigmoid(self.bias + sum(self.weights[i] * v for i, v in vector.items()))
+
+    def predict_proba(self, question: str) -> float:
+        """Probability that the question should go to PRO"""
+        return self._score(self._vectorize(question))
+
+    def predict(self, question: str) -> Tuple[str, float]:
+        """Return ("FLASH" | "PRO", confidence)"""
+        p = self.predict_proba(question)
+        return ("PRO", p) if p >= 0.5 else ("FLASH", 1 - p)
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "vocabulary": self.vocabulary,
+                "idf": self.idf,
+                "weights": self.weights,
+                "bias": self.bias
+            }, f)
+
+    @classmethod
+    def load(cls, path: str) -> "LocalRouteClassifier":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+    @classmethod
+    def from_decision_log(cls, path: str, min_confidence: float = 0.7, **fit_kwargs) -> "LocalRouteClassifier":
+        """Train from the JSONL decisions ModelRouter writes, keeping only confident ones"""
+        questions, labels = _load_decisions(path, min_confidence)
+        return cls().fit(questions, labels, **fit_kwargs)
+
+def _load_decisions(path: str, min_confidence: float) -> Tuple[List[str], List[str]]:
+    questions, labels = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            decision = json.loads(line)
+            if decision["confidence"] >= min_confidence:
+                questions.append(decision["question"])
+                labels.append(decision["model"])
+    return questions, labels
+
+def _accuracy(classifier: LocalRouteClassifier, samples: Iterable[Tuple[str, str]]) -> float:
+    samples = list(samples)
+    correct = sum(1 for q, label in samples if classifier.predict(q)[0] == label)
+    return correct / len(samples) if samples else 0.0
+
+if __name__ == "__main__":
+    log_path, model_path = sys.argv[1], sys.argv[2]
+    questions, labels = _load_decisions(log_path, min_confidence=0.7)
+    samples = list(zip(questions, labels))
+    random.Random(0).shuffle(samples)
+    split = int(len(samples) * 0.8)
+    train, holdout = samples[:split], samples[split:]
+
+    classifier = LocalRouteClassifier().fit([q for q, _ in train], [l for _, l in train])
+    print(f"Trained on {len(train)} decisions, holdout accuracy: {_accuracy(classifier, holdout):.2%}")
+
+    # Final model uses every decision
+    LocalRouteClassifier().fit(questions, labels).save(model_path)
+    print(f"Saved classifier to {model_path}")
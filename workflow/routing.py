@@ -1,27 +1,61 @@
 import google.generativeai as genai
-from typing import Dict, List, Tuple
+from typing import AsyncIterator, Dict, List, Optional, Tuple, TypedDict
 import re
 from dotenv import load_dotenv
 import os
 from enum import Enum
 import json
+import asyncio
+import hashlib
+import time
+from datetime import datetime
+
+from cache import MemoryCache, ResponseCache, normalize_question
+from json_extract import ModelOutputError, parse_json
+from llm_client import LLMClient, get_client
+from route_classifier import LocalRouteClassifier
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
+class RouteDecision(TypedDict):
+    model: str
+    confidence: float
+
+class IndexedRouteDecision(RouteDecision):
+    index: int
+
 class ModelType(Enum):
     FLASH = "gemini-1.5-flash"
     PRO = "gemini-1.5-pro"
 
+# Used when the router's reply can't be parsed - its low confidence routes to FLASH
+FALLBACK_DECISION = (ModelType.PRO, 0.5)
+
 class ModelRouter:
-    def __init__(self):
-        genai.configure(api_key=GEMINI_API_KEY)
+    def __init__(self,
+                 client: LLMClient = None,
+                 response_cache: ResponseCache = None,
+                 classifier: LocalRouteClassifier = None,
+                 classifier_threshold: float = 0.85,
+                 decision_log_path: str = None,
+                 decision_cache_size: int = 4096):
+        self.client = client or get_client()
+        # Optional answer cache - repeated questions skip both the routing and the answer call
+        self.response_cache = response_cache
+        # Routing decisions memoized by question fingerprint
+        self._decision_cache = MemoryCache(decision_cache_size)
+        # Local classifier answers confident cases in-process; the LLM router handles the rest
+        self.classifier = classifier
+        self.classifier_threshold = classifier_threshold
+        # LLM router decisions are appended here as training data for the classifier
+        self.decision_log_path = decision_log_path
         # Initialize both models
-        self.flash_model = genai.GenerativeModel('gemini-1.5-flash')
-        self.pro_model = genai.GenerativeModel('gemini-1.5-pro')
+        self.flash_model = self.client.gemini_model('gemini-1.5-flash')
+        self.pro_model = self.client.gemini_model('gemini-1.5-pro')
         
         # Router model for classification
-        self.router_model = genai.GenerativeModel('gemini-1.5-flash')
+        self.router_model = self.client.gemini_model('gemini-1.5-flash')
         
         # Define routing criteria patterns
         self.complex_patterns = {
@@ -49,10 +83,15 @@ class ModelRouter:
                 r"performance\s+optimization"
             ]
         }
+        # Each heuristic compiled once as its own regex, grouped by category and run on the
+        # lowercased question - kept separate rather than one combined pattern (see _compile_matcher)
+        self._complexity_matcher = self._compile_matcher(self.complex_patterns)
 
-    async def _analyze_complexity(self, question: str) -> Tuple[ModelType, float]:
+    async def _analyze_complexity(self, question: str) -> Optional[Tuple[ModelType, float]]:
         """
         Use the router model to analyze question complexity and choose appropriate model
+
+        Returns None when the router's reply can't be parsed.
         """
         prompt = f"""
         Analyze this technical question and determine if it requires Gemini 1.5 Pro (for complex reasoning) 
@@ -74,62 +113,313 @@ class ModelRouter:
         - Quick factual queries -> Flash
         """
 
-        response = self.router_model.generate_content(prompt)
+        response = await self.client.generate(self.router_model, prompt)
         try:
-            result = json.loads(response.text)
+            result = parse_json(response.text, RouteDecision, label="route_decision")
             model_type = ModelType[result["model"]]
             confidence = float(result["confidence"])
             return model_type, confidence
-        except (json.JSONDecodeError, KeyError):
-            # Default to PRO if analysis fails
-            return ModelType.PRO, 0.5
+        except (ModelOutputError, KeyError):
+            return None
 
-    def _pattern_match_complexity(self, question: str) -> bool:
-        """Check if question matches any complex patterns"""
-        question = question.lower()
-        
-        # Check all patterns
-        for category, patterns in self.complex_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, question):
-                    return True
-        return False
+    def _log_decision(self, question: str, model_type: ModelType, confidence: float):
+        """Append an LLM routing decision to the decision log"""
+        if self.decision_log_path is None:
+            return
+        with open(self.decision_log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "question": question,
+                "model": model_type.name,
+                "confidence": confidence,
+                "timestamp": datetime.now().isoformat()
+            }) + "\n")
+
+    @staticmethod
+    def _fingerprint(question: str) -> str:
+        return hashlib.blake2b(normalize_question(question).encode("utf-8"), digest_size=16).hexdigest()
+
+    @staticmethod
+    def _compile_matcher(complex_patterns: Dict[str, List[str]]) -> List[Tuple[str, List[re.Pattern]]]:
+        """Precompile every complex pattern once, grouped by category
+
+        Patterns stay separate on purpose: each one starts with a literal, so re can use its fast
+        substring search. A single alternation of all of them is scanned position by position and
+        measured over 20x slower on long inputs (see bench_routing.py).
+        """
+        return [
+            (category, [re.compile(pattern) for pattern in patterns])
+            for category, patterns in complex_patterns.items()
+        ]
 
-    def _contains_code_block(self, text: str) -> bool:
-        """Check if text contains code blocks"""
-        return bool(re.search(r'```[\s\S]*?```', text))
+    def _match_complexity(self, question: str) -> Optional[str]:
+        """Return the category of the first complexity indicator found in the question, or None"""
+        # Same as re.search(r'```[\s\S]*?```') but without the lazy char-by-char scan
+        fence = question.find("```")
+        if fence != -1 and question.find("```", fence + 3) != -1:
+            return "code_block"
+
+        lowered = question.lower()
+        for category, patterns in self._complexity_matcher:
+            if any(pattern.search(lowered) for pattern in patterns):
+                return category
+        return None
 
     async def route_question(self, question: str) -> genai.GenerativeModel:
         """
         Route the question to appropriate model based on complexity analysis
         """
         # First check for obvious indicators
-        if self._contains_code_block(question) or self._pattern_match_complexity(question):
+        if self._match_complexity(question):
             return self.pro_model
-            
-        # Use LLM router for more nuanced analysis
-        model_type, confidence = await self._analyze_complexity(question)
+
+        # Reuse an earlier decision for the same question
+        key = self._fingerprint(question)
+        model_type = self._decision_cache.get(key)
+        if model_type is None:
+            model_type, cacheable = await self._classify(question)
+            if cacheable:
+                self._decision_cache.set(key, model_type)
+
+        return self.pro_model if model_type == ModelType.PRO else self.flash_model
+
+    def _classify_locally(self, question: str) -> Optional[ModelType]:
+        """Model type from the local classifier, or None when it is missing or unsure"""
+        if self.classifier is not None:
+            label, confidence = self.classifier.predict(question)
+            if confidence >= self.classifier_threshold:
+                return ModelType[label]
+        return None
+
+    def _apply_llm_decision(self, question: str, model_type: ModelType, confidence: float) -> ModelType:
+        """Log an LLM router decision and apply the low-confidence fallback"""
+        self._log_decision(question, model_type, confidence)
         
-        # If confidence is low, fall back to pattern matching
+        # If confidence is low, fall back to pattern matching - callers have already
+        # checked the patterns and found nothing, so that means FLASH
         if confidence < 0.7:
-            return self.pro_model if self._pattern_match_complexity(question) else self.flash_model
+            return ModelType.FLASH
             
-        return self.pro_model if model_type == ModelType.PRO else self.flash_model
+        return model_type
+
+    def _decide(self, question: str, analysis: Optional[Tuple[ModelType, float]]) -> Tuple[ModelType, bool]:
+        """(model type, cacheable) from an LLM router analysis
+
+        An unparseable reply gets the fallback decision, which isn't cacheable - one bad reply
+        shouldn't route the question for the rest of the process.
+        """
+        if analysis is None:
+            return self._apply_llm_decision(question, *FALLBACK_DECISION), False
+        return self._apply_llm_decision(question, *analysis), True
+
+    async def _classify(self, question: str) -> Tuple[ModelType, bool]:
+        """(model type, cacheable) from the local classifier if it is confident, else the LLM router"""
+        model_type = self._classify_locally(question)
+        if model_type is not None:
+            return model_type, True
+
+        # Use LLM router for more nuanced analysis
+        return self._decide(question, await self._analyze_complexity(question))
+
+    async def _analyze_complexity_batch(self, questions: List[str]) -> List[Optional[Tuple[ModelType, float]]]:
+        """Classify several questions with a single router prompt
+
+        Questions the reply has no parseable decision for get None, as in _analyze_complexity.
+        """
+        # Long pastes are trimmed - the start of a question is enough to judge its complexity
+        numbered = "\n".join(f"{i}. {json.dumps(q[:2000])}" for i, q in enumerate(questions))
+        prompt = f"""
+        For each technical question below, determine if it requires Gemini 1.5 Pro (for complex reasoning) 
+        or if Gemini 1.5 Flash (for simpler queries) would suffice.
+
+        Questions:
+        {numbered}
+
+        Return ONLY a JSON array with one object per question, in the same order:
+        [{{"index": 0, "model": "FLASH" or "PRO", "confidence": number between 0-1}}]
+
+        Consider:
+        - Complex reasoning/analysis needs -> Pro
+        - System design/architecture -> Pro
+        - Advanced code review/debugging -> Pro
+        - Simple explanations/basic concepts -> Flash
+        - Straightforward code questions -> Flash
+        - Quick factual queries -> Flash
+        """
+
+        decisions: List[Optional[Tuple[ModelType, float]]] = [None] * len(questions)
+        response = await self.client.generate(self.router_model, prompt)
+        try:
+            for item in parse_json(response.text, List[IndexedRouteDecision], label="route_decision_batch"):
+                index = item["index"]
+                if 0 <= index < len(questions):
+                    decisions[index] = (ModelType[item["model"]], float(item["confidence"]))
+        except (ModelOutputError, KeyError):
+            print(f"Failed to parse batch routing response for {len(questions)} questions")
+        return decisions
+
+    async def route_many(self, questions: List[str], batch_size: int = 25) -> List[genai.GenerativeModel]:
+        """Route a batch of questions, keeping input order
+
+        Heuristics, remembered decisions and the local classifier are tried first; whatever
+        is left goes to the LLM router, `batch_size` questions per prompt, chunks in parallel.
+        """
+        decisions: List[Optional[ModelType]] = [None] * len(questions)
+        # Fingerprint -> indexes of questions still needing the LLM router
+        pending: Dict[str, List[int]] = {}
+        for i, question in enumerate(questions):
+            if self._match_complexity(question):
+                decisions[i] = ModelType.PRO
+                continue
+            key = self._fingerprint(question)
+            model_type = self._decision_cache.get(key) or self._classify_locally(question)
+            if model_type is not None:
+                self._decision_cache.set(key, model_type)
+                decisions[i] = model_type
+            else:
+                pending.setdefault(key, []).append(i)
+
+        keys = list(pending)
+        chunks = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+        analyses = await asyncio.gather(*[
+            self._analyze_complexity_batch([questions[pending[key][0]] for key in chunk])
+            for chunk in chunks
+        ])
+        for chunk, chunk_analyses in zip(chunks, analyses):
+            for key, analysis in zip(chunk, chunk_analyses):
+                decision, cacheable = self._decide(questions[pending[key][0]], analysis)
+                if cacheable:
+                    self._decision_cache.set(key, decision)
+                for i in pending[key]:
+                    decisions[i] = decision
+
+        return [self.pro_model if d == ModelType.PRO else self.flash_model for d in decisions]
+
+    def _cached_response(self, question: str) -> Optional[Dict]:
+        if self.response_cache is None:
+            return None
+        cached = self.response_cache.get(question)
+        if cached is None:
+            return None
+        return {
+            "model_used": cached["model_used"],
+            "response": cached["response"],
+            "timestamp": datetime.now().isoformat(),
+            "cached": cached["cache_match"]
+        }
+
+    async def get_responses(self, questions: List[str], max_concurrency: Dict[str, int] = None,
+                            batch_size: int = 25) -> List[Dict]:
+        """Route and answer many questions; results come back in input order
+
+        Questions are classified together with route_many, then the Flash and Pro groups are
+        answered concurrently, each under its own concurrency limit. A failed answer is
+        reported in an `error` field instead of failing the whole batch.
+        """
+        limits = {ModelType.FLASH.name: 16, ModelType.PRO.name: 4, **(max_concurrency or {})}
+        semaphores = {
+            self.flash_model.model_name: asyncio.Semaphore(limits[ModelType.FLASH.name]),
+            self.pro_model.model_name: asyncio.Semaphore(limits[ModelType.PRO.name])
+        }
+
+        results: List[Optional[Dict]] = [None] * len(questions)
+        # Identical questions are answered once
+        unanswered: Dict[str, List[int]] = {}
+        for i, question in enumerate(questions):
+            results[i] = self._cached_response(question)
+            if results[i] is None:
+                unanswered.setdefault(question, []).append(i)
+
+        unique_questions = list(unanswered)
+        models = await self.route_many(unique_questions, batch_size=batch_size)
+
+        async def answer(question: str, model: genai.GenerativeModel):
+            async with semaphores[model.model_name]:
+                try:
+                    response = await self.client.generate(model, question)
+                    result = {
+                        "model_used": model.model_name,
+                        "response": response.text,
+                        "timestamp": datetime.now().isoformat()
+                    }
+                    if self.response_cache is not None:
+                        self.response_cache.set(question, result)
+                except Exception as e:
+                    result = {
+                        "model_used": model.model_name,
+                        "error": str(e),
+                        "timestamp": datetime.now().isoformat()
+                    }
+            for i in unanswered[question]:
+                results[i] = result
+
+        await asyncio.gather(*[answer(q, m) for q, m in zip(unique_questions, models)])
+        return results
 
     async def get_response(self, question: str) -> Dict:
         """Get response from the appropriate model with metadata"""
+        cached = self._cached_response(question)
+        if cached is not None:
+            return cached
+
         model = await self.route_question(question)
-        response = model.generate_content(question)
+        response = await self.client.generate(model, question)
         
-        return {
+        result = {
             "model_used": model.model_name,
             "response": response.text,
             "timestamp": datetime.now().isoformat()
         }
+        if self.response_cache is not None:
+            self.response_cache.set(question, result)
+        return result
+
+    async def stream_response(self, question: str) -> AsyncIterator[Dict]:
+        """Stream the answer from the routed model as it is generated
+
+        Yields {"type": "token", "text": ...} events as chunks arrive, then a final
+        {"type": "done", ...} event with model_used, the full response, the timestamp and
+        timings in seconds: routing_time, time_to_first_token and total_time.
+        """
+        start = time.perf_counter()
+        cached = self._cached_response(question)
+        if cached is not None:
+            yield {"type": "token", "text": cached["response"]}
+            elapsed = time.perf_counter() - start
+            yield {"type": "done", **cached, "routing_time": 0.0,
+                   "time_to_first_token": elapsed, "total_time": elapsed}
+            return
+
+        model = await self.route_question(question)
+        routed = time.perf_counter()
+
+        first_token = None
+        chunks = []
+        async for text in self.client.stream(model, question):
+            if first_token is None:
+                first_token = time.perf_counter()
+            chunks.append(text)
+            yield {"type": "token", "text": text}
+        end = time.perf_counter()
+
+        result = {
+            "model_used": model.model_name,
+            "response": "".join(chunks),
+            "timestamp": datetime.now().isoformat()
+        }
+        if self.response_cache is not None:
+            self.response_cache.set(question, result)
+        yield {
+            "type": "done",
+            **result,
+            "routing_time": routed - start,
+            "time_to_first_token": (first_token or end) - start,
+            "total_time": end - start
+        }
 
 # Example usage
 async def main():
-    router = ModelRouter()
+    # Exact and normalized matches only - see ResponseCache before enabling similarity
+    router = ModelRouter(response_cache=ResponseCache())
     
     # Test cases
     questions = [
@@ -145,13 +435,20 @@ async def main():
         "What's the syntax for a for loop in JavaScript?"
     ]
     
-    for question in questions:
-        response = await router.get_response(question)
+    responses = await router.get_responses(questions)
+    for question, response in zip(questions, responses):
         print(f"\nQuestion: {question[:50]}...")
         print(f"Routed to: {response['model_used']}")
         # print(f"Response: {response['response']}"), Uncomment this to see the response
 
+    # Streaming: print tokens as they arrive, then the timing summary
+    print("\nStreaming answer:\n")
+    async for event in router.stream_response("Explain what a Python generator is in two sentences"):
+        if event["type"] == "token":
+            print(event["text"], end="", flush=True)
+        else:
+            print(f"\n\n[{event['model_used']}] first token after {event['time_to_first_token']:.2f}s, "
+                  f"done after {event['total_time']:.2f}s")
+
 if __name__ == "__main__":
-    import asyncio
-    from datetime import datetime
     asyncio.run(main())
@@ -0,0 +1,167 @@
+# Local shopping list builder - replaces the LLM round-trip in MealPlanChain.create_shopping_list
+# Parses ingredient strings, merges duplicates with unit conversion and categorizes from a lookup table
+
+import re
+from fractions import Fraction
+from typing import Dict, List, Optional, Tuple
+
+# unit alias -> (dimension, factor to the base unit: grams, milliliters or pieces)
+UNITS = {
+    "g": ("mass", 1.0), "gram": ("mass", 1.0), "grams": ("mass", 1.0),
+    "kg": ("mass", 1000.0), "kilogram": ("mass", 1000.0), "kilograms": ("mass", 1000.0),
+    "oz": ("mass", 28.3495), "ounce": ("mass", 28.3495), "ounces": ("mass", 28.3495),
+    "lb": ("mass", 453.592), "lbs": ("mass", 453.592), "pound": ("mass", 453.592), "pounds": ("mass", 453.592),
+    "ml": ("volume", 1.0), "milliliter": ("volume", 1.0), "milliliters": ("volume", 1.0),
+    "l": ("volume", 1000.0), "liter": ("volume", 1000.0), "liters": ("volume", 1000.0),
+    "tsp": ("volume", 4.92892), "teaspoon": ("volume", 4.92892), "teaspoons": ("volume", 4.92892),
+    "tbsp": ("volume", 14.7868), "tablespoon": ("volume", 14.7868), "tablespoons": ("volume", 14.7868),
+    "cup": ("volume", 236.588), "cups": ("volume", 236.588),
+    "piece": ("count", 1.0), "pieces": ("count", 1.0), "whole": ("count", 1.0),
+    "slice": ("count", 1.0), "slices": ("count", 1.0), "clove": ("count", 1.0), "cloves": ("count", 1.0)
+}
+
+# Words that describe preparation or size rather than what to buy
+DESCRIPTORS = {
+    "fresh", "chopped", "diced", "sliced", "minced", "grated", "shredded", "large", "small", "medium",
+    "organic", "raw", "cooked", "boiled", "steamed", "grilled", "roasted", "baked", "ripe", "frozen",
+    "boneless", "skinless", "lean", "plain", "whole", "of", "a", "an", "to", "taste", "optional", "handful"
+}
+
+# Irregular or non-English plurals the suffix rules below would get wrong
+SINGULARS = {"leaves": "leaf", "loaves": "loaf", "berries": "berry", "asparagus": "asparagus",
+             "hummus": "hummus", "couscous": "couscous", "molasses": "molasses", "oats": "oats",
+             "greens": "greens", "lentils": "lentil", "chickpeas": "chickpea"}
+
+ALIASES = {"scallion": "green onion", "spring onion": "green onion", "garbanzo bean": "chickpea",
+           "courgette": "zucchini", "aubergine": "eggplant", "coriander": "cilantro"}
+
+# Category -> ingredient keywords; multi-word keywords are checked before single words
+CATEGORIES = {
+    "Produce": ["apple", "banana", "berry", "blueberry", "strawberry", "raspberry", "orange", "lemon", "lime",
+                "avocado", "tomato", "potato", "sweet potato", "onion", "green onion", "garlic", "ginger",
+                "spinach", "kale", "lettuce", "broccoli", "cauliflower", "carrot", "pepper", "bell pepper",
+                "cucumber", "zucchini", "eggplant", "mushroom", "celery", "asparagus", "cilantro", "parsley",
+                "basil", "mint", "greens", "cabbage", "pear", "grape", "mango", "pineapple", "peach"],
+    "Meat & Seafood": ["chicken", "beef", "pork", "turkey", "lamb", "salmon", "tuna", "cod", "shrimp",
+                       "fish", "steak", "bacon", "ham", "sausage", "tilapia"],
+    "Dairy & Eggs": ["egg", "milk", "cheese", "yogurt", "greek yogurt", "butter", "cream", "cottage cheese",
+                     "feta", "mozzarella", "parmesan"],
+    "Grains & Bakery": ["oats", "rice", "brown rice", "quinoa", "bread", "tortilla", "pasta", "noodle",
+                        "couscous", "bagel", "wrap", "granola", "cereal", "flour"],
+    "Pantry": ["oil", "olive oil", "vinegar", "salt", "black pepper", "honey", "sugar", "soy sauce", "sauce",
+               "spice", "cumin", "paprika", "cinnamon", "peanut butter", "almond butter", "nut", "almond",
+               "walnut", "seed", "chia seed", "flaxseed", "lentil", "chickpea", "bean", "black bean", "tofu",
+               "hummus", "broth", "stock", "protein powder", "maple syrup", "mustard", "salsa"]
+}
+
+_KEYWORDS = sorted(
+    ((keyword, category) for category, keywords in CATEGORIES.items() for keyword in keywords),
+    key=lambda kc: -len(kc[0].split())
+)
+
+_QUANTITY = re.compile(r"^\s*(\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?)\s*([a-zA-Z]+\.?)?\s*(.*)$")
+
+def _singular(word: str) -> str:
+    if word in SINGULARS:
+        return SINGULARS[word]
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "xes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us")) and len(word) > 3:
+        return word[:-1]
+    return word
+
+def normalize_name(name: str) -> str:
+    """Canonical ingredient name - "Fresh Chopped Tomatoes (ripe)" -> "tomato" """
+    name = re.sub(r"\(.*?\)", " ", name.lower())
+    name = name.split(",")[0]
+    words = [_singular(w) for w in re.findall(r"[a-z]+", name) if w not in DESCRIPTORS]
+    normalized = " ".join(words)
+    return ALIASES.get(normalized, normalized)
+
+def parse_ingredient(text: str) -> Tuple[Optional[str], float, str]:
+    """Split "1 1/2 cups oats" into (dimension, amount in base units, normalized name)
+
+    Dimension is "mass", "volume" or "count", or None when the string has no quantity.
+    """
+    match = _QUANTITY.match(text)
+    if not match:
+        return None, 1.0, normalize_name(text)
+    amount = float(sum(Fraction(part) for part in match.group(1).split()))
+    unit = (match.group(2) or "").lower().rstrip(".")
+    rest = match.group(3)
+    if unit in UNITS:
+        dimension, factor = UNITS[unit]
+        return dimension, amount * factor, normalize_name(rest)
+    # "2 eggs" - the word after the number is part of the name
+    return "count", amount, normalize_name(f"{unit} {rest}")
+
+def categorize(name: str) -> Optional[str]:
+    """Category from the lookup table, or None when the ingredient isn't recognized"""
+    padded = f" {name} "
+    for keyword, category in _KEYWORDS:
+        if f" {keyword} " in padded:
+            return category
+    return None
+
+def _decimal(value: float) -> str:
+    """Up to two decimals without trailing zeros - 1.25, 1.5, 125"""
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+def _format_amount(dimension: Optional[str], amount: float) -> str:
+    if dimension == "mass":
+        return f"{_decimal(amount / 1000)} kg" if amount >= 1000 else f"{round(amount)} g"
+    if dimension == "volume":
+        if amount >= 1000:
+            return f"{_decimal(amount / 1000)} L"
+        cups = round(amount / UNITS["cup"][1] * 4) / 4
+        # Recipes mostly use cups, so show them from a quarter cup up
+        return f"{cups:g} cup" + ("s" if cups != 1 else "") if cups >= 0.25 else f"{round(amount)} ml"
+    if dimension == "count":
+        return f"{amount:g}"
+    return f"{amount:g} serving" + ("s" if amount != 1 else "")
+
+def consolidate_ingredients(meal_options: List[Dict]) -> Dict[str, Dict[Optional[str], float]]:
+    """Normalized name -> {dimension: summed amount} over every option of every meal"""
+    totals: Dict[str, Dict[Optional[str], float]] = {}
+    for meal in meal_options:
+        for option in meal.get("options", []):
+            for ingredient in option.get("ingredients", []):
+                dimension, amount, name = parse_ingredient(str(ingredient))
+                if not name:
+                    continue
+                by_dimension = totals.setdefault(name, {})
+                by_dimension[dimension] = by_dimension.get(dimension, 0.0) + amount
+    return totals
+
+def unknown_ingredients(meal_options: List[Dict]) -> List[str]:
+    """Normalized names the category table doesn't recognize"""
+    return [name for name in consolidate_ingredients(meal_options) if categorize(name) is None]
+
+def build_shopping_list(meal_options: List[Dict], extra_categories: Dict[str, str] = None) -> Dict:
+    """Shopping list in the schema create_shopping_list returns
+
+    extra_categories maps unrecognized names to categories (e.g. from a model); anything
+    still unknown goes under "Other". Items have no estimated_cost or alternatives - there
+    is nothing local to base them on.
+    """
+    extra_categories = extra_categories or {}
+    categories: Dict[str, List[Dict]] = {}
+    for name, by_dimension in consolidate_ingredients(meal_options).items():
+        category = categorize(name) or extra_categories.get(name) or "Other"
+        categories.setdefault(category, []).append({
+            "name": name.title(),
+            # Amounts in different dimensions (e.g. "2" and "100 g") can't be converted, so list both
+            "quantity": " + ".join(_format_amount(d, a) for d, a in by_dimension.items())
+        })
+    order = list(CATEGORIES) + ["Other"]
+    return {
+        "shopping_list": [
+            {"category": category, "items": sorted(items, key=lambda item: item["name"])}
+            for category, items in sorted(
+                categories.items(),
+                key=lambda ci: order.index(ci[0]) if ci[0] in order else len(order)
+            )
+        ]
+    }
@@ -0,0 +1,27 @@
+# Tests for the local nutrition calculator
+# Run from workflow/: python -m pytest test_nutrition.py
+
+import pytest
+
+from nutrition import calculate_requirements, calculate_requirements_batch
+
+USERS = [
+    {"age": 30, "weight": "150lbs", "height": "5'10", "activity_level": "moderate",
+     "goals": "lose weight", "restrictions": ["vegan"]},
+    {"age": "45", "weight": "82 kg", "height": "180cm", "activity_level": "sedentary",
+     "goals": ["build muscle"], "sex": "female"},
+    {"age": 22, "weight": 70, "height": "175 cm", "activity_level": "very active",
+     "goals": "maintain", "health_conditions": "diabetes"}
+]
+
+def test_batch_matches_single_user_calculation():
+    assert calculate_requirements_batch(USERS) == [calculate_requirements(user) for user in USERS]
+
+def test_batch_returns_none_for_unparseable_users():
+    users = [USERS[0], {**USERS[1], "age": None}, {**USERS[2], "height": "tall"}]
+
+    results = calculate_requirements_batch(users)
+
+    assert results == [calculate_requirements(USERS[0]), None, None]
+    with pytest.raises(ValueError):
+        calculate_requirements(users[1])
@@ -0,0 +1,47 @@
+# Tests for SurgeryVotingSystem vote parsing with a fake model client
+# Run from workflow/: python -m pytest test_parallelization.py
+
+import asyncio
+import json
+
+from parallelization import SurgeryVotingSystem
+
+PATIENT = {
+    "age": 45,
+    "pain_level": 8,
+    "symptom_duration": "6 months",
+    "previous_treatments": ["Physical therapy"],
+    "mri_findings": "L4-L5 herniation",
+    "neurological_symptoms": ["Leg numbness"]
+}
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeClient:
+    """Answers every vote prompt with the same response text"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+    async def generate(self, model, prompt, **kwargs):
+        await asyncio.sleep(0)
+        return FakeResponse(self.text)
+
+def _vote(response: dict):
+    system = SurgeryVotingSystem(models=["model"], client=FakeClient(json.dumps(response)))
+    return asyncio.run(system.get_vote("model", PATIENT))
+
+def test_vote_without_risks_or_benefits_is_kept():
+    vote = _vote({"recommendation": "surgery", "confidence": 0.9, "reasoning": ["Severe pain"]})
+
+    assert vote["recommendation"] == "surgery"
+    assert vote["confidence"] == 0.9
+    assert vote["reasoning"] == ["Severe pain"]
+
+def test_vote_missing_a_required_field_falls_back():
+    vote = _vote({"recommendation": "surgery", "reasoning": ["Severe pain"]})
+
+    assert vote["recommendation"] == "no_surgery"
+    assert vote["reasoning"] == ["Failed to parse model response"]
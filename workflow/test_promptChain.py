@@ -0,0 +1,91 @@
+# Tests for MealPlanChain.generate_options_and_shopping_list with a fake model client
+# Run from workflow/: python -m pytest test_promptChain.py
+
+import asyncio
+import json
+
+from promptChain import MealPlanChain
+
+STRUCTURE = {
+    "meals": [
+        {"meal_name": "Breakfast", "calories": 500},
+        {"meal_name": "Lunch", "calories": 700}
+    ]
+}
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeClient:
+    """Answers meal-option and shopping-list prompts and counts each kind of call"""
+
+    def __init__(self):
+        self.calls = {"options": 0, "shopping_list": 0, "other": 0}
+
+    def gemini_model(self, model_name, **kwargs):
+        return model_name
+
+    async def generate(self, model, prompt, **kwargs):
+        await asyncio.sleep(0)
+        if "Generate meal options" in prompt:
+            self.calls["options"] += 1
+            return FakeResponse(json.dumps({
+                "meal_name": "ignored",
+                "options": [{
+                    "name": "Oats and eggs",
+                    "ingredients": ["1 cup oats", "2 eggs"],
+                    "preparation_time": "10 minutes",
+                    "cooking_instructions": ["Cook"],
+                    "macronutrients": {"protein": 20, "carbs": 40, "fats": 10},
+                    "calories": 400
+                }]
+            }))
+        if "consolidated shopping list" in prompt:
+            self.calls["shopping_list"] += 1
+            return FakeResponse(json.dumps({
+                "shopping_list": [{
+                    "category": "Grains",
+                    "items": [{"name": "Oats", "quantity": "1 bag", "estimated_cost": 2.5, "alternatives": ["Muesli"]}]
+                }]
+            }))
+        self.calls["other"] += 1
+        return FakeResponse("{}")
+
+def _run(local: bool):
+    client = FakeClient()
+    chain = MealPlanChain(client=client)
+    meal_options, shopping_list = asyncio.run(
+        chain.generate_options_and_shopping_list(STRUCTURE, ["none"], local=local)
+    )
+    return client, meal_options, shopping_list
+
+def _items(shopping_list):
+    return {
+        item["name"]: item
+        for category in shopping_list["shopping_list"]
+        for item in category["items"]
+    }
+
+def test_local_shopping_list_is_built_without_the_model():
+    client, meal_options, shopping_list = _run(local=True)
+
+    assert [m["meal_name"] for m in meal_options["meal_options"]] == ["Breakfast", "Lunch"]
+    assert client.calls == {"options": 2, "shopping_list": 0, "other": 0}
+    # Quantities are converted and added, not joined as strings
+    items = _items(shopping_list)
+    assert items["Oats"]["quantity"] == "2 cups"
+    assert items["Egg"]["quantity"] == "4"
+    # Nothing local to price items with, so no made-up costs
+    assert "estimated_cost" not in items["Oats"]
+
+def test_model_shopping_list_is_requested_per_meal_and_merged():
+    client, meal_options, shopping_list = _run(local=False)
+
+    assert [m["meal_name"] for m in meal_options["meal_options"]] == ["Breakfast", "Lunch"]
+    assert client.calls == {"options": 2, "shopping_list": 2, "other": 0}
+    items = _items(shopping_list)
+    assert list(items) == ["Oats"]
+    assert items["Oats"]["quantity"] == "1 bag + 1 bag"
+    assert items["Oats"]["estimated_cost"] == 5.0
+    assert items["Oats"]["alternatives"] == ["Muesli"]